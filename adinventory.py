@@ -0,0 +1,295 @@
+# adinventory.py — Weighted ad rotation with caps and batched impression counters
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ad_counters (
+    day         TEXT NOT NULL,
+    ad_id       INTEGER NOT NULL,
+    impressions INTEGER NOT NULL DEFAULT 0,
+    completions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, ad_id)
+);
+CREATE TABLE IF NOT EXISTS ad_user_counters (
+    day         TEXT NOT NULL,
+    ad_id       INTEGER NOT NULL,
+    user_id     TEXT NOT NULL,
+    impressions INTEGER NOT NULL DEFAULT 0,
+    updated_at  REAL NOT NULL,
+    PRIMARY KEY (day, ad_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS ad_user_counters_updated ON ad_user_counters (updated_at);
+"""
+
+# Per-user counts written by other workers are re-read with this much overlap, so a
+# row stamped just before its transaction committed is not missed
+USER_SYNC_OVERLAP = 60.0
+
+# Keys an ad entry in the config may carry; only id and video_url (or file) are required
+AD_KEYS = ("id", "video_url", "file", "weight", "daily_cap", "user_daily_cap")
+
+
+def build_alias(weights):
+    """Vose's alias method: (prob, alias) tables for O(1) weighted sampling."""
+    n = len(weights)
+    total = float(sum(weights))
+    prob = [w * n / total for w in weights]
+    alias = [0] * n
+    small = [i for i, p in enumerate(prob) if p < 1.0]
+    large = [i for i, p in enumerate(prob) if p >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        alias[s] = l
+        prob[l] -= 1.0 - prob[s]
+        (small if prob[l] < 1.0 else large).append(l)
+    for i in small + large:
+        prob[i] = 1.0  # leftovers are 1 up to float rounding
+    return prob, alias
+
+
+def load_ads(path):
+    """Read and validate the ad config file; returns {ad_id: ad dict}."""
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)["ads"]
+    ads = {}
+    for entry in entries:
+        unknown = set(entry) - set(AD_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown ad config keys: {sorted(unknown)}")
+        if not (entry.get("video_url") or entry.get("file")):
+            raise ValueError(f"Ad {entry.get('id')} has neither video_url nor file")
+        ad = {"weight": 1, "daily_cap": None, "user_daily_cap": None, **entry}
+        ad["id"] = int(ad["id"])
+        if ad["weight"] <= 0:
+            continue  # weight 0 pauses an ad without deleting it
+        ads[ad["id"]] = ad
+    return ads
+
+
+class AdInventory:
+    """Ad rotation loaded from a JSON config, hot-reloaded when the file changes.
+
+    pick() samples an ad by weight in O(1) with an alias table, skipping
+    ads that hit their daily impression cap (they drop out of the table)
+    or the user's daily frequency cap (re-sampled a few times, then a
+    weighted pick over what is left). Impression and completion counts
+    live in memory and are flushed to the store's ad_counters table in
+    one transaction every flush interval, not once per view. Per-user
+    impressions are only kept for ads with a user_daily_cap, and are
+    flushed to ad_user_counters the same way, so the caps survive restarts
+    and hold across workers to within one flush interval.
+    """
+
+    def __init__(self, path, store, reload_every=5.0, max_tries=8):
+        self.path = path
+        self.store = store
+        self.reload_every = reload_every
+        self.max_tries = max_tries
+        self._lock = threading.Lock()
+        self._ads = {}
+        self._mtime = None
+        self._checked = 0.0
+        self._day = None
+        self._today = {}  # ad_id -> [impressions, completions] for today, flushed or not
+        self._pending = {}  # (day, ad_id) -> [impressions, completions] not yet flushed
+        self._seen = {}  # (user_id, ad_id) -> the user's impressions today, capped ads only
+        self._seen_pending = {}  # (day, ad_id, user_id) -> impressions not yet flushed
+        self._seen_synced = 0.0  # time.time() of the last per-user resync
+        self._table = ([], [], [])  # (ad ids, prob, alias) over ads still under their daily cap
+        self.store.connect().executescript(SCHEMA)
+        self._load()
+
+    def _load(self):
+        mtime = os.stat(self.path).st_mtime
+        try:
+            ads = load_ads(self.path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if not self._ads:
+                raise
+            logger.error(f"Ad config {self.path} not reloaded, keeping the current ads: {e}")
+            self._mtime = mtime
+            return
+        with self._lock:
+            self._ads = ads
+            self._mtime = mtime
+            self._rebuild()
+        logger.info(f"Loaded {len(ads)} ads from {self.path}")
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.reload_every:
+            return
+        self._checked = now
+        try:
+            changed = os.stat(self.path).st_mtime != self._mtime
+        except OSError:
+            return
+        if changed:
+            self._load()
+
+    def _rebuild(self):
+        ids = [
+            ad_id for ad_id, ad in self._ads.items()
+            if ad["daily_cap"] is None or self._today.get(ad_id, [0, 0])[0] < ad["daily_cap"]
+        ]
+        if not ids:
+            self._table = ([], [], [])
+            return
+        prob, alias = build_alias([self._ads[ad_id]["weight"] for ad_id in ids])
+        self._table = (ids, prob, alias)
+
+    def _roll_day(self):
+        day = datetime.utcnow().date().isoformat()
+        if day == self._day:
+            return
+        self._day = day
+        db = self.store.connect()
+        rows = db.execute("SELECT ad_id, impressions, completions FROM ad_counters WHERE day = ?", (day,))
+        self._today = {row[0]: [row[1], row[2]] for row in rows}
+        rows = db.execute("SELECT user_id, ad_id, impressions FROM ad_user_counters WHERE day = ?", (day,))
+        self._seen = {(row[0], row[1]): row[2] for row in rows}
+        self._seen_synced = time.time()
+        self._rebuild()
+
+    def get(self, ad_id):
+        """Return the ad dict for ad_id, or None."""
+        self._maybe_reload()
+        return self._ads.get(ad_id)
+
+    def ads(self):
+        self._maybe_reload()
+        return list(self._ads.values())
+
+    def _allowed_for(self, user_id, ad):
+        cap = ad["user_daily_cap"]
+        return cap is None or self._seen.get((user_id, ad["id"]), 0) < cap
+
+    def pick(self, user_id):
+        """Choose an ad for user_id, or None if every ad is capped for them today."""
+        self._maybe_reload()
+        user_id = str(user_id)
+        with self._lock:
+            self._roll_day()
+            ids, prob, alias = self._table
+            if not ids:
+                return None
+            chosen = None
+            for _ in range(self.max_tries):
+                i = random.randrange(len(ids))
+                ad = self._ads[ids[i] if random.random() < prob[i] else ids[alias[i]]]
+                if self._allowed_for(user_id, ad):
+                    chosen = ad
+                    break
+            if chosen is None:
+                # The user has hit the cap on the likely ads; pick among the rest by weight
+                eligible = [self._ads[ad_id] for ad_id in ids if self._allowed_for(user_id, self._ads[ad_id])]
+                if not eligible:
+                    return None
+                chosen = random.choices(eligible, weights=[ad["weight"] for ad in eligible])[0]
+            return chosen
+
+    def _count(self, ad_id, index, user_id=None):
+        with self._lock:
+            self._roll_day()
+            self._pending.setdefault((self._day, ad_id), [0, 0])[index] += 1
+            ad = self._ads.get(ad_id)
+            if user_id is not None and ad and ad["user_daily_cap"] is not None:
+                user_id = str(user_id)
+                self._seen[(user_id, ad_id)] = self._seen.get((user_id, ad_id), 0) + 1
+                key = (self._day, ad_id, user_id)
+                self._seen_pending[key] = self._seen_pending.get(key, 0) + 1
+            today = self._today.setdefault(ad_id, [0, 0])
+            today[index] += 1
+            if index == 0 and ad and ad["daily_cap"] is not None and today[0] == ad["daily_cap"]:
+                logger.info(f"Ad {ad_id} reached its daily cap of {ad['daily_cap']}")
+                self._rebuild()
+
+    def impression(self, ad_id, user_id=None):
+        """Count one ad page view (by user_id, for the ad's user_daily_cap)."""
+        self._count(ad_id, 0, user_id)
+
+    def completion(self, ad_id):
+        """Count one fully watched (rewarded) view."""
+        self._count(ad_id, 1)
+
+    def flush(self):
+        """Write the pending counts in one transaction, then resync today's totals.
+
+        The resync folds in what other worker processes flushed, so daily
+        caps hold across workers to within one flush interval. Per-user
+        counts are resynced only for rows updated since the last flush.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            seen_pending, self._seen_pending = self._seen_pending, {}
+            day = self._day
+            since = self._seen_synced - USER_SYNC_OVERLAP
+        now = time.time()
+        if pending or seen_pending:
+            try:
+                with self.store.transaction() as db:
+                    db.executemany(
+                        "INSERT INTO ad_counters (day, ad_id, impressions, completions) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (day, ad_id) DO UPDATE SET "
+                        "impressions = impressions + excluded.impressions, completions = completions + excluded.completions",
+                        [(d, ad_id, imp, comp) for (d, ad_id), (imp, comp) in pending.items()],
+                    )
+                    db.executemany(
+                        "INSERT INTO ad_user_counters (day, ad_id, user_id, impressions, updated_at) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT (day, ad_id, user_id) DO UPDATE SET "
+                        "impressions = impressions + excluded.impressions, updated_at = excluded.updated_at",
+                        [(d, ad_id, user_id, imp, now) for (d, ad_id, user_id), imp in seen_pending.items()],
+                    )
+                    if day is not None:
+                        # per-user counts only matter on the day they were made
+                        db.execute("DELETE FROM ad_user_counters WHERE day < ?", (day,))
+            except Exception:
+                # Put the counts back so the next flush retries them
+                with self._lock:
+                    for key, (imp, comp) in pending.items():
+                        counts = self._pending.setdefault(key, [0, 0])
+                        counts[0] += imp
+                        counts[1] += comp
+                    for key, imp in seen_pending.items():
+                        self._seen_pending[key] = self._seen_pending.get(key, 0) + imp
+                raise
+        if day is not None:
+            db = self.store.connect()
+            rows = db.execute(
+                "SELECT ad_id, impressions, completions FROM ad_counters WHERE day = ?", (day,)
+            ).fetchall()
+            user_rows = db.execute(
+                "SELECT user_id, ad_id, impressions FROM ad_user_counters WHERE updated_at >= ? AND day = ?",
+                (since, day),
+            ).fetchall()
+            with self._lock:
+                if self._day == day:
+                    today = {row[0]: [row[1], row[2]] for row in rows}
+                    for (d, ad_id), (imp, comp) in self._pending.items():
+                        if d == day:
+                            counts = today.setdefault(ad_id, [0, 0])
+                            counts[0] += imp
+                            counts[1] += comp
+                    self._today = today
+                    for user_id, ad_id, imp in user_rows:
+                        self._seen[(user_id, ad_id)] = imp + self._seen_pending.get((day, ad_id, user_id), 0)
+                    self._seen_synced = now
+                    self._rebuild()
+        return len(pending)
+
+    async def run_flusher(self, interval):
+        """Flush counters every `interval` seconds, off the event loop thread."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Ad counter flush failed: {e}")
@@ -0,0 +1,65 @@
+# adpage.py — Compiled, pre-rendered ad page with ETag support
+import hashlib
+import logging
+import os
+import time
+
+from jinja2 import Environment
+
+logger = logging.getLogger(__name__)
+
+
+class AdPageCache:
+    """Loads and compiles the ad page template once and pre-renders it per ad.
+
+    Pages are cached per (ad_id, context), so a context change such as a
+    different video source gets its own pre-rendered page.
+
+    Nothing in the page depends on the user (the page fetches its view
+    token separately), so serving a request is a dict lookup and every
+    user shares the page's ETag. With auto_reload the template file is
+    re-checked (at most once per `reload_every` seconds) and everything is
+    rebuilt when it changes.
+    """
+
+    def __init__(self, path, auto_reload=False, reload_every=1.0):
+        # Plain synchronous env: the page is rendered once, not per request
+        self.jinja_env = Environment(autoescape=True)
+        self.path = path
+        self.auto_reload = auto_reload
+        self.reload_every = reload_every
+        self._template = None
+        self._mtime = None
+        self._checked = 0.0
+        self._pages = {}  # (ad_id, context) -> (html, etag)
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            self._template = self.jinja_env.from_string(f.read())
+        self._mtime = os.stat(self.path).st_mtime
+        self._pages = {}
+        logger.info(f"Compiled ad page template {self.path}")
+
+    def _maybe_reload(self):
+        if self._template is None:
+            self._load()
+            return
+        if not self.auto_reload:
+            return
+        now = time.monotonic()
+        if now - self._checked < self.reload_every:
+            return
+        self._checked = now
+        if os.stat(self.path).st_mtime != self._mtime:
+            self._load()
+
+    def render(self, ad_id, **context):
+        """Return (html, etag) for an ad, rendering it on first use."""
+        self._maybe_reload()
+        key = (ad_id, *sorted(context.items()))
+        cached = self._pages.get(key)
+        if cached is None:
+            html = self._template.render(ad_id=ad_id, **context)
+            etag = hashlib.sha1(html.encode("utf-8")).hexdigest()[:16]
+            cached = self._pages[key] = (html, f'"{etag}"')
+        return cached
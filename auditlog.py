@@ -0,0 +1,233 @@
+# auditlog.py — Rotating JSON Lines admin audit log with indexed tail reads
+import fcntl
+import glob
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    seq      INTEGER PRIMARY KEY AUTOINCREMENT,
+    segment  TEXT NOT NULL,
+    offset   INTEGER NOT NULL,
+    action   TEXT NOT NULL,
+    admin_id INTEGER,
+    target   TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_segment ON entries (segment);
+CREATE INDEX IF NOT EXISTS entries_action ON entries (action, seq);
+CREATE INDEX IF NOT EXISTS entries_admin ON entries (admin_id, seq);
+CREATE INDEX IF NOT EXISTS entries_target ON entries (target, seq);
+"""
+
+ACTIVE = ""  # segment name of the file currently being written
+
+
+class AdminLog:
+    """Append-only JSON Lines audit log of admin actions.
+
+    The active file is rotated to `<path>.<timestamp>` once it reaches
+    max_bytes or is older than rotate_every; only the newest `keep`
+    rotated files are kept. tail() seeks backwards from the end of the
+    files instead of reading them whole, and filtered tails go through a
+    small SQLite index (`<path>.idx`) of (action, admin_id, target) ->
+    file offset, so /logs costs the same however long the history is.
+
+    log() only queues the entry; a writer thread appends whatever is queued
+    with one write and indexes it in one transaction, so callers on the
+    event loop never touch the disk. tail() waits for queued entries first.
+
+    Every worker process writes the same files, so appends and rotations
+    hold an exclusive flock on `<path>.lock` and reads a shared one. The
+    rotation age comes from the first entry in the active file, not from
+    when a process opened it.
+    """
+
+    def __init__(self, path, max_bytes=5 * 1024 * 1024, rotate_every=timedelta(days=1), keep=10):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_every = rotate_every
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._index = sqlite3.connect(path + ".idx", isolation_level=None, check_same_thread=False)
+        self._index.executescript(INDEX_SCHEMA)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="admin-log-writer", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _parse(line):
+        try:
+            return json.loads(line)
+        except ValueError:
+            # plain-text line from before the log was structured
+            return {"ts": "", "action": "", "text": line}
+
+    def _first_timestamp(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            first = f.readline().strip()
+        try:
+            return datetime.fromisoformat(self._parse(first).get("ts", ""))
+        except ValueError:
+            return None
+
+    def _segment_path(self, segment):
+        return self.path if segment == ACTIVE else f"{self.path}.{segment}"
+
+    def _segments_newest_first(self):
+        rotated = sorted(glob.glob(glob.escape(self.path) + ".2*"), reverse=True)
+        return [ACTIVE] + [p[len(self.path) + 1:] for p in rotated]
+
+    @contextmanager
+    def _file_lock(self, operation):
+        with open(self.path + ".lock", "ab") as f:
+            fcntl.flock(f, operation)  # released when the file is closed
+            yield
+
+    def _size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def _rotate(self, now):
+        segment = now.strftime("%Y%m%dT%H%M%S%f")
+        os.replace(self.path, self._segment_path(segment))
+        self._index.execute("UPDATE entries SET segment = ? WHERE segment = ?", (segment, ACTIVE))
+        for old in self._segments_newest_first()[self.keep + 1:]:
+            os.remove(self._segment_path(old))
+            self._index.execute("DELETE FROM entries WHERE segment = ?", (old,))
+
+    def log(self, action, admin_id=None, target=None, **details):
+        """Queue one entry: action name, acting admin, affected user and any details."""
+        now = datetime.utcnow()
+        entry = {"ts": now.isoformat(), "action": action, "admin_id": admin_id}
+        if target is not None:
+            entry["target"] = str(target)
+        entry.update(details)
+        line = json.dumps(entry, ensure_ascii=False) + "\n"  # json escapes newlines, so one entry = one line
+        self._queue.put((now, action, admin_id, entry.get("target"), line.encode("utf-8")))
+
+    def flush(self):
+        """Block until every queued entry is on disk."""
+        self._queue.join()
+
+    def _append(self, chunk, rows):
+        with open(self.path, "ab") as f:
+            f.write(chunk)
+        self._index.execute("BEGIN")
+        self._index.executemany(
+            "INSERT INTO entries (segment, offset, action, admin_id, target) VALUES (?, ?, ?, ?, ?)", rows
+        )
+        self._index.execute("COMMIT")
+
+    def _write(self, items):
+        # From the size check to the index commit: another worker may append or rotate otherwise
+        with self._file_lock(fcntl.LOCK_EX):
+            size = self._size()
+            opened_at = self._first_timestamp(self.path)
+            chunk, rows = b"", []
+            for now, action, admin_id, target, data in items:
+                opened_at = opened_at or now
+                if size + len(chunk) >= self.max_bytes or now - opened_at >= self.rotate_every:
+                    # Entries before the rotation must be on disk and indexed under the active segment
+                    if chunk:
+                        self._append(chunk, rows)
+                        chunk, rows = b"", []
+                    if self._size():
+                        self._rotate(now)
+                    size, opened_at = 0, now
+                rows.append((ACTIVE, size + len(chunk), action, admin_id, target))
+                chunk += data
+            if chunk:
+                self._append(chunk, rows)
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._lock:
+                    self._write(items)
+            except Exception as e:
+                if self._index.in_transaction:
+                    self._index.execute("ROLLBACK")
+                logger.error(f"Failed to write {len(items)} admin log entries: {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _read_backwards(path, n, block=8192):
+        """Return up to the last n lines of a file, newest first, reading from the end."""
+        lines = []
+        with open(path, "rb") as f:
+            pos = f.seek(0, os.SEEK_END)
+            tail = b""
+            while pos > 0 and len(lines) < n:
+                step = min(block, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step) + tail
+                parts = chunk.split(b"\n")
+                tail = parts.pop(0)  # may be a partial line; finish it with the next block
+                lines.extend(p for p in reversed(parts) if p.strip())
+            if pos == 0 and tail.strip() and len(lines) < n:
+                lines.append(tail)
+        return [line.decode("utf-8", "replace") for line in lines[:n]]
+
+    def tail(self, n=50, action=None, admin_id=None, target=None):
+        """Return the newest n entries (dicts, newest first), optionally filtered."""
+        self.flush()
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            if action is None and admin_id is None and target is None:
+                entries = []
+                for segment in self._segments_newest_first():
+                    path = self._segment_path(segment)
+                    if os.path.exists(path):
+                        entries.extend(self._parse(line) for line in self._read_backwards(path, n - len(entries)))
+                    if len(entries) >= n:
+                        break
+                return entries
+
+            where, params = [], []
+            for col, value in (("action", action), ("admin_id", admin_id), ("target", target)):
+                if value is not None:
+                    where.append(f"{col} = ?")
+                    params.append(str(value) if col == "target" else value)
+            rows = self._index.execute(
+                f"SELECT segment, offset FROM entries WHERE {' AND '.join(where)} ORDER BY seq DESC LIMIT ?",
+                (*params, n),
+            ).fetchall()
+            entries = []
+            files = {}
+            try:
+                for segment, offset in rows:
+                    if segment not in files:
+                        files[segment] = open(self._segment_path(segment), "rb")
+                    f = files[segment]
+                    f.seek(offset)
+                    entries.append(self._parse(f.readline().decode("utf-8", "replace")))
+            finally:
+                for f in files.values():
+                    f.close()
+            return entries
+
+    @staticmethod
+    def format(entry):
+        """One-line human-readable rendering of an entry for /logs."""
+        if entry.get("text"):
+            return entry["text"]
+        extra = " ".join(f"{k}={v}" for k, v in entry.items() if k not in ("ts", "action", "admin_id", "target"))
+        target = f" target={entry['target']}" if entry.get("target") else ""
+        return f"{entry.get('ts', '')}  {entry.get('action', '')} admin={entry.get('admin_id')}{target} {extra}".rstrip()
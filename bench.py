@@ -0,0 +1,875 @@
+# bench.py — Stress and benchmark scripts for bot.py
+#
+#   python bench.py watched --requests 5000 --concurrency 64 --users 200
+#   python bench.py ad_page --requests 5000
+#   python bench.py ad_pick --requests 200000 --users 1000
+#   python bench.py ratelimit --requests 100000 --users 1000
+#   python bench.py media --requests 50
+#   python bench.py workers --requests 3000 --workers 1,2,4
+#   python bench.py load --sizes 1000,100000,1000000 --requests 5000 --concurrency 32
+#   python bench.py startup --runs 5 --api-latency 0.15
+#   python bench.py updates --users 300 --levels 1,8,64 --api-latency 0.05
+#   python bench.py reminders --sizes 1000,100000,1000000
+#   python bench.py sweep --sizes 1000000 --budget 600
+#
+# Runs against a throwaway user store and audit log in a temp dir, never the real ones.
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import parse_qsl
+
+TMP_DIR = tempfile.mkdtemp(prefix="bot-bench-")
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ["USER_STORE"] = f"sqlite:{os.path.join(TMP_DIR, 'users.db')}"
+os.environ["ADMIN_LOG_FILE"] = os.path.join(TMP_DIR, "admin_actions.log")
+os.environ.setdefault("RATE_LIMITS", "")  # the load would trip every limit from one client
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_bot():
+    sys.path.insert(0, HERE)
+    import bot
+    logging.getLogger().setLevel(logging.WARNING)
+    return bot
+
+
+# ------------------------
+# /watched stress test
+# ------------------------
+async def bench_watched(args):
+    """Fire concurrent /watched posts, check every balance is exact, then replay them all."""
+    bot = load_bot()
+    # tg_app isn't started here, so the notifications just queue up in the outbox
+    logging.getLogger("outbox").setLevel(logging.CRITICAL)
+    bot.view_tokens.min_watch = 0
+    client = bot.app.test_client()
+    user_ids = [str(900000000 + i) for i in range(args.users)]
+    targets = [random.choice(user_ids) for _ in range(args.requests)]
+    tokens = [await bot.view_tokens.mint(uid, 0) for uid in targets]
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def post(uid, token):
+        async with slots:
+            resp = await client.post("/watched", json={"user_id": uid, "token": token})
+            return uid, resp.status_code, await resp.get_json()
+
+    expected = defaultdict(float)
+    errors = 0
+    started = time.perf_counter()
+    for uid, status, body in await asyncio.gather(*(post(uid, t) for uid, t in zip(targets, tokens))):
+        if status != 200:
+            errors += 1
+            continue
+        expected[uid] += body["reward"]
+    elapsed = time.perf_counter() - started
+
+    # Every token is spent now; replays must all bounce without touching balances
+    started = time.perf_counter()
+    replays = await asyncio.gather(*(post(uid, t) for uid, t in zip(targets, tokens)))
+    replay_elapsed = time.perf_counter() - started
+    replays_accepted = sum(1 for _, status, _ in replays if status == 200)
+
+    mismatched = []
+    for uid, total in expected.items():
+        balance = bot.user_store.get(uid)["balance"]
+        if round(balance, 2) != round(total, 2):
+            mismatched.append((uid, total, balance))
+
+    print(f"/watched: {args.requests} posts, {args.concurrency} in flight, {args.users} users")
+    print(f"  {elapsed:.2f}s, {args.requests / elapsed:.0f} req/s, {errors} HTTP errors")
+    print(f"  replays: {args.requests / replay_elapsed:.0f} req/s, {replays_accepted} accepted")
+    print(f"  balances checked: {len(expected)}, mismatched: {len(mismatched)}")
+    for uid, total, balance in mismatched[:10]:
+        print(f"    {uid}: expected ₹{round(total, 2)}, stored ₹{round(balance, 2)}")
+    return 1 if mismatched or errors or replays_accepted else 0
+
+
+# ------------------------
+# /ad/<id> page rendering
+# ------------------------
+async def bench_ad_page(args):
+    """Compare requests/s of the cached ad page against the old read+render path."""
+    from quart import render_template_string
+    bot = load_bot()
+
+    @bot.app.route("/bench/ad_uncached/<int:ad_id>")
+    async def ad_page_uncached(ad_id):
+        # What ad_page() did before the template cache
+        ad = bot.ad_inventory.get(ad_id)
+        with open("index.html", "r", encoding="utf-8") as f:
+            html = f.read()
+        return await render_template_string(
+            html, video_src=ad["video_url"], domain=bot.DOMAIN, ad_id=ad_id, user_id="900000001"
+        )
+
+    client = bot.app.test_client()
+    ad_ids = [ad["id"] for ad in bot.ad_inventory.ads()]
+
+    async def run(path, headers=None):
+        started = time.perf_counter()
+        for i in range(args.requests):
+            resp = await client.get(path.format(ad_ids[i % len(ad_ids)]), headers=headers)
+            assert resp.status_code in (200, 304), resp.status_code
+        return args.requests / (time.perf_counter() - started)
+
+    before = await run("/bench/ad_uncached/{}")
+    after = await run("/ad/{}?user_id=900000001")
+    print(f"/ad/<id>: {args.requests} sequential requests each")
+    print(f"  before (read + render per request): {before:.0f} req/s")
+    print(f"  after (cached, pre-rendered):       {after:.0f} req/s ({after / before:.1f}x)")
+    etag = (await client.get("/ad/0?user_id=900000001")).headers["ETag"]
+    revalidate = await run("/ad/0?user_id=900000001", {"If-None-Match": etag})
+    print(f"  revalidation (304 Not Modified):    {revalidate:.0f} req/s")
+    return 0
+
+
+# ------------------------
+# Ad selection
+# ------------------------
+async def bench_ad_pick(args):
+    """Time AdInventory.pick() over a 1000-ad inventory and check the weights are honoured."""
+    import json
+    from adinventory import AdInventory
+    bot = load_bot()
+    path = os.path.join(TMP_DIR, "ads.json")
+    weights = [random.randint(1, 10) for _ in range(1000)]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"ads": [{"id": i, "video_url": f"https://cdn.invalid/{i}.mp4", "weight": w}
+                           for i, w in enumerate(weights)]}, f)
+    inventory = AdInventory(path, bot.user_store)
+    user_ids = [str(900000000 + i) for i in range(args.users)]
+    picks = defaultdict(int)
+    started = time.perf_counter()
+    for i in range(args.requests):
+        picks[inventory.pick(user_ids[i % len(user_ids)])["id"]] += 1
+    elapsed = time.perf_counter() - started
+    # Heaviest vs lightest ads should be picked roughly in proportion to their weights
+    heavy = [i for i, w in enumerate(weights) if w == 10]
+    light = [i for i, w in enumerate(weights) if w == 1]
+    ratio = (sum(picks[i] for i in heavy) / len(heavy)) / max(sum(picks[i] for i in light) / len(light), 1e-9)
+    print(f"ad pick: {args.requests} picks over {len(weights)} ads")
+    print(f"  {elapsed / args.requests * 1e6:.1f} µs per pick, weight-10 vs weight-1 pick ratio {ratio:.1f} (expect ~10)")
+    return 0
+
+
+# ------------------------
+# Rate limiter cost
+# ------------------------
+async def bench_ratelimit(args):
+    """Time allowed hits and rejections for the memory and SQLite backends."""
+    bot = load_bot()
+    from ratelimit import MemoryBackend, RateLimiter, SQLiteBackend
+
+    for name, backend in (("memory", MemoryBackend()), ("sqlite", SQLiteBackend(bot.user_store))):
+        limiter = RateLimiter({"ad": (5, 60)}, backend)
+        keys = [str(900000000 + i) for i in range(args.users)]
+        started = time.perf_counter()
+        for key in keys:
+            for _ in range(5):
+                assert not await limiter.check("ad", key)
+        allowed = (time.perf_counter() - started) / (5 * len(keys))
+        started = time.perf_counter()
+        for i in range(args.requests):
+            assert await limiter.check("ad", keys[i % len(keys)])
+        rejected = (time.perf_counter() - started) / args.requests
+        print(f"{name}: allowed hit {allowed * 1e6:.1f} µs, rejection {rejected * 1e6:.1f} µs")
+    return 0
+
+
+# ------------------------
+# Ad video time-to-first-byte
+# ------------------------
+async def bench_media(args):
+    """Time-to-first-byte of each ad video: local /media (real uvicorn server) vs the CDN URL."""
+    import httpx
+    import uvicorn
+    bot = load_bot()
+    port = 18765
+    server = uvicorn.Server(uvicorn.Config(bot.app, port=port, log_level="warning", lifespan="off"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    async def ttfb(client, url):
+        samples = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            async with client.stream("GET", url) as resp:
+                async for _ in resp.aiter_raw():
+                    samples.append(time.perf_counter() - started)
+                    break
+            if resp.status_code != 200:
+                raise RuntimeError(f"HTTP {resp.status_code}")
+        samples.sort()
+        return samples[len(samples) // 2], samples[int(len(samples) * 0.95)]
+
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            for ad in bot.ad_inventory.ads():
+                sources = [("remote", ad["video_url"])]
+                if ad.get("file"):
+                    sources.insert(0, ("local", f"http://127.0.0.1:{port}/media/{ad['file']}"))
+                for name, url in sources:
+                    try:
+                        p50, p95 = await ttfb(client, url)
+                        print(f"{name:6} {url}\n         TTFB p50 {p50 * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms")
+                    except Exception as e:
+                        print(f"{name:6} {url}\n         failed: {e}")
+    finally:
+        server.should_exit = True
+        await serving
+    return 0
+
+
+# ------------------------
+# Fake Bot API (stands in for api.telegram.org; point TELEGRAM_API_URL at it)
+# ------------------------
+FAKE_BOT = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "benchbot"}
+FAKE_API_CALLS = defaultdict(int)
+FAKE_WEBHOOK = {"url": ""}  # what setWebhook last registered
+FAKE_API_DELAY = 0.0  # seconds added to every call, standing in for the round trip to Telegram
+FAKE_API_WAITERS = defaultdict(list)  # chat_id / callback_query_id -> futures awaiting the bot's next call
+
+
+async def fake_bot_api(scope, receive, send):
+    """Minimal ASGI Bot API: answers every method with a plausible "ok" result."""
+    if scope["type"] != "http":
+        return
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    method = scope["path"].rsplit("/", 1)[-1]
+    FAKE_API_CALLS[method] += 1
+    if FAKE_API_DELAY:
+        await asyncio.sleep(FAKE_API_DELAY)
+    try:
+        params = json.loads(body) if body.startswith(b"{") else dict(parse_qsl(body.decode()))
+    except ValueError:
+        params = {}
+    chat_id = params.get("chat_id") or 1
+    chat_id = int(chat_id) if str(chat_id).lstrip("-").isdigit() else 1  # "@group" handles too
+    waiters = FAKE_API_WAITERS.get(str(params.get("callback_query_id") or params.get("chat_id")))
+    if waiters:
+        waiter = waiters.pop(0)
+        if not waiter.done():
+            waiter.set_result(method)
+    if method == "getMe":
+        result = FAKE_BOT
+    elif method == "getChatMember":
+        result = {"status": "member", "user": {"id": int(params.get("user_id") or 1), "is_bot": False, "first_name": "U"}}
+    elif method in ("sendMessage", "sendDocument", "editMessageText", "editMessageReplyMarkup"):
+        result = {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+    elif method == "getWebhookInfo":
+        result = {"url": FAKE_WEBHOOK["url"], "has_custom_certificate": False, "pending_update_count": 0}
+    elif method == "setWebhook":
+        FAKE_WEBHOOK["url"] = params.get("url", "")
+        result = True
+    else:
+        result = True
+    payload = json.dumps({"ok": True, "result": result}).encode()
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def start_fake_api(port):
+    """Serve fake_bot_api on 127.0.0.1:port in this loop; returns the uvicorn Server."""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(fake_bot_api, port=port, log_level="warning", lifespan="off"))
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server
+
+
+# ------------------------
+# gunicorn worker scaling
+# ------------------------
+async def bench_workers(args):
+    """Run the real app under gunicorn with 1, 2, 4... workers and drive full ad views through it."""
+    import httpx
+    api_port, app_port = 18766, 18767
+    api = await start_fake_api(api_port)
+    results = []
+    user_ids = [str(900000000 + i) for i in range(args.users)]
+    for workers in [int(n) for n in args.workers.split(",")]:
+        db_path = os.path.join(TMP_DIR, f"workers-{workers}.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        env = dict(
+            os.environ,
+            USER_STORE=f"sqlite:{db_path}",
+            TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}/bot",
+            WEB_CONCURRENCY=str(workers),
+            MIN_WATCH_SECONDS="0",
+            RATE_LIMITS="",
+            SET_WEBHOOK="1",
+        )
+        FAKE_API_CALLS.clear()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "bot:app", "-k", "uvicorn.workers.UvicornWorker",
+             "--workers", str(workers), "--bind", f"127.0.0.1:{app_port}", "--log-level", "warning"],
+            cwd=HERE, env=env,
+        )
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=30) as client:
+                for _ in range(200):
+                    try:
+                        await client.get("/")
+                        break
+                    except httpx.TransportError:
+                        await asyncio.sleep(0.1)
+                await asyncio.sleep(1.0)  # let every worker finish booting
+                # View tokens are only minted for users who started the bot, as in production
+                for i, uid in enumerate(user_ids):
+                    await client.post(f"/{os.environ['BOT_TOKEN']}", json=fake_update(i + 1, uid, "/start"))
+                db = sqlite3.connect(db_path)
+                for _ in range(300):
+                    if db.execute("SELECT COUNT(*) FROM users").fetchone()[0] >= len(user_ids):
+                        break
+                    await asyncio.sleep(0.1)
+                db.close()
+                refused = (await client.post("/ad/0/token", json={"user_id": "1"})).status_code
+                slots = asyncio.Semaphore(args.concurrency)
+                expected = defaultdict(float)
+                errors = 0
+
+                async def view(uid):
+                    # Full ad view: the page, its view token, then report it watched
+                    async with slots:
+                        await client.get(f"/ad/0?user_id={uid}")
+                        token = (await client.post("/ad/0/token", json={"user_id": uid})).json()["token"]
+                        resp = await client.post("/watched", json={"user_id": uid, "token": token})
+                        return uid, resp.status_code, resp.json()
+
+                started = time.perf_counter()
+                for uid, status, body in await asyncio.gather(
+                    *(view(random.choice(user_ids)) for _ in range(args.requests))
+                ):
+                    if status != 200:
+                        errors += 1
+                        continue
+                    expected[uid] += body["reward"]
+                elapsed = time.perf_counter() - started
+                db = sqlite3.connect(db_path)
+                leaders = db.execute("SELECT COUNT(DISTINCT owner) FROM leases WHERE name = 'leader'").fetchone()[0]
+                db.close()
+        finally:
+            proc.terminate()
+            proc.wait()
+
+        db = sqlite3.connect(db_path)
+        stored = dict(db.execute("SELECT user_id, balance FROM users WHERE user_id >= '9'").fetchall())
+        db.close()
+        mismatched = sum(1 for uid, total in expected.items() if round(stored.get(uid, 0), 2) != round(total, 2))
+        errors += refused != 403
+        results.append((workers, args.requests / elapsed, errors, mismatched))
+        print(f"{workers} worker(s): {args.requests / elapsed:.0f} ad views/s, {errors} errors, "
+              f"{mismatched} mismatched balances, {leaders} leader, {FAKE_API_CALLS['setWebhook']} setWebhook call(s), "
+              f"token for a user who never started: {refused}")
+    api.should_exit = True
+    base = results[0][1]
+    print("scaling: " + ", ".join(f"{w}w = {rate / base:.2f}x" for w, rate, _, _ in results)
+          + f" (on {os.cpu_count()} CPU(s))")
+    return 1 if any(errors or mismatched for _, _, errors, mismatched in results) else 0
+
+
+# ------------------------
+# End-to-end load: webhook updates and ad routes over a large user base
+# ------------------------
+LOAD_MIX = (  # (operation, relative weight)
+    ("start", 5),
+    ("button", 40),
+    ("bonus_claim", 15),
+    ("admin", 5),
+    ("ad_view", 35),
+)
+LOAD_BUTTONS = ("▶️ Ad Dekhe", "💵 Balance", "👥 Refer & Earn", "🎁 Bonus", "⚙️ Extra")
+LOAD_ADMIN_COMMANDS = ("/stats", "/iostats", "/find user1234")
+
+
+def rss_mb():
+    """Resident set size of this process in MB (peak RSS where /proc isn't available)."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(samples, p):
+    """p-th percentile (0-100) of an already sorted list."""
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def fake_update(update_id, user_id, text=None, callback_data=None):
+    """A Telegram Update payload: a private text message, or a callback query when callback_data is set."""
+    user = {"id": int(user_id), "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+    message = {"message_id": update_id, "date": int(time.time()), "chat": {"id": int(user_id), "type": "private"}}
+    if callback_data is not None:
+        query = {"id": str(update_id), "from": user, "chat_instance": "1", "data": callback_data,
+                 "message": {**message, "text": "🎁 Bonus"}}
+        return {"update_id": update_id, "callback_query": query}
+    message.update({"from": user, "text": text})
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def seed_users(store, count, batch=50000):
+    """Insert count synthetic users ("100000000".."1xxxxxxxx") straight into the SQLite store."""
+    joined_at = datetime.utcnow().isoformat()
+    for start in range(0, count, batch):
+        rows = (
+            (str(100000000 + i), round(random.uniform(0, 500), 2), i % 3 == 0, f"User{i}", f"user{i}", joined_at)
+            for i in range(start, min(start + batch, count))
+        )
+        with store.transaction() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO users (user_id, balance, joined_groups, first_name, username, joined_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+    store.stats.reconcile()
+
+
+async def bench_load(args):
+    """Drive the real webhook, /ad and /watched routes with a mixed workload at each user-base size.
+
+    Each size runs in its own process so the memory numbers don't carry
+    over. Update latency is measured from the webhook POST to the bot's
+    first Bot API call answering it (the reply the user would see).
+    """
+    sizes = [int(n) for n in args.sizes.split(",")]
+    if len(sizes) > 1:
+        failed = 0
+        for size in sizes:
+            failed |= subprocess.call(
+                [sys.executable, os.path.abspath(__file__), "load", "--sizes", str(size),
+                 "--requests", str(args.requests), "--concurrency", str(args.concurrency)],
+            )
+        return failed
+
+    size = sizes[0]
+    api_port = 18768
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{api_port}/bot"
+    api = await start_fake_api(api_port)
+    rss_start = rss_mb()
+    bot = load_bot()
+    # tg_app isn't serving real chats, so drop outbox noise
+    logging.getLogger("outbox").setLevel(logging.CRITICAL)
+    bot.view_tokens.min_watch = 0
+
+    started = time.perf_counter()
+    await asyncio.to_thread(seed_users, bot.user_store, size)
+    seed_elapsed = time.perf_counter() - started
+    rss_seeded = rss_mb()
+
+    user_ids = [str(100000000 + random.randrange(size)) for _ in range(args.requests)]
+    ops = random.choices([op for op, _ in LOAD_MIX], weights=[w for _, w in LOAD_MIX], k=args.requests)
+    ad_ids = [ad["id"] for ad in bot.ad_inventory.ads()]
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    slots = asyncio.Semaphore(args.concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def send_update(kind, key, payload):
+        # Wait for the first Bot API call the handler makes for this chat/callback
+        waiter = loop.create_future()
+        FAKE_API_WAITERS[key].append(waiter)
+        t0 = time.perf_counter()
+        resp = await client.post(f"/{bot.BOT_TOKEN}", json=payload)
+        try:
+            if resp.status_code != 200:
+                raise RuntimeError(f"HTTP {resp.status_code}")
+            await asyncio.wait_for(waiter, args.timeout)
+            samples[kind].append(time.perf_counter() - t0)
+        except (RuntimeError, asyncio.TimeoutError):
+            errors[kind] += 1
+            if waiter in FAKE_API_WAITERS[key]:
+                FAKE_API_WAITERS[key].remove(waiter)
+
+    async def timed(kind, call):
+        t0 = time.perf_counter()
+        resp = await call
+        if resp.status_code != 200:
+            errors[kind] += 1
+            return None
+        samples[kind].append(time.perf_counter() - t0)
+        return resp
+
+    async def run_op(update_id, op, uid):
+        async with slots:
+            if op == "start":
+                await send_update("update /start", uid, fake_update(update_id, uid, "/start"))
+            elif op == "button":
+                await send_update("update button", uid, fake_update(update_id, uid, random.choice(LOAD_BUTTONS)))
+            elif op == "bonus_claim":
+                await send_update("update bonus_claim", str(update_id), fake_update(update_id, uid, callback_data="bonus_claim"))
+            elif op == "admin":
+                admin = str(bot.ADMIN_ID)
+                await send_update("update admin", admin, fake_update(update_id, admin, random.choice(LOAD_ADMIN_COMMANDS)))
+            else:
+                ad_id = random.choice(ad_ids)
+                page = await timed("GET /ad/<id>", client.get(f"/ad/{ad_id}?user_id={uid}"))
+                minted = page and await timed("POST /ad/<id>/token", client.post(f"/ad/{ad_id}/token", json={"user_id": uid}))
+                if minted:
+                    token = (await minted.get_json())["token"]
+                    await timed("POST /watched", client.post("/watched", json={"user_id": uid, "token": token}))
+
+    async with bot.app.test_app() as test_app:
+        client = test_app.test_client()
+        started = time.perf_counter()
+        await asyncio.gather(*(run_op(i + 1, op, uid) for i, (op, uid) in enumerate(zip(ops, user_ids))))
+        elapsed = time.perf_counter() - started
+        rss_end = rss_mb()
+    api.should_exit = True
+
+    db_mb = sum(
+        os.path.getsize(path) / 1024 / 1024
+        for path in (bot.user_store.path + suffix for suffix in ("", "-wal"))
+        if os.path.exists(path)
+    )
+    print(f"load: {size} users, {args.requests} operations, {args.concurrency} in flight")
+    print(f"  seeded in {seed_elapsed:.1f}s, database {db_mb:.0f} MB")
+    print(f"  {elapsed:.2f}s, {args.requests / elapsed:.0f} ops/s")
+    print(f"  {'':22} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for kind in sorted(set(samples) | set(errors)):
+        done = sorted(samples[kind])
+        if done:
+            p50, p95, p99 = (percentile(done, p) * 1000 for p in (50, 95, 99))
+            print(f"  {kind:22} {len(done):6} {p50:8.1f} {p95:8.1f} {p99:8.1f} {errors[kind]:6}")
+        else:
+            print(f"  {kind:22} {0:6} {'-':>8} {'-':>8} {'-':>8} {errors[kind]:6}")
+    print(f"  RSS: {rss_start:.0f} MB at start, {rss_seeded:.0f} MB after import + seed, {rss_end:.0f} MB after the run")
+    return 1 if sum(errors.values()) else 0
+
+
+# ------------------------
+# Cold start: process launch to first responses
+# ------------------------
+async def bench_startup(args):
+    """Launch the app under gunicorn repeatedly; time `import bot`, the first 200 on / and the first update reply."""
+    import httpx
+    global FAKE_API_DELAY
+    FAKE_API_DELAY = args.api_latency
+    api_port, app_port = 18770, 18771
+    api = await start_fake_api(api_port)
+    env = dict(
+        os.environ,
+        TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}/bot",
+        RATE_LIMITS="",
+        PYTHONDONTWRITEBYTECODE="1",
+    )
+    probe = "import time; t = time.perf_counter(); import bot; print(time.perf_counter() - t)"
+    imports, first_ok, first_reply = [], [], []
+    loop = asyncio.get_running_loop()
+    for run in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", probe], cwd=HERE, env=env, capture_output=True, text=True)
+        imports.append(float(out.stdout.strip().splitlines()[-1]))
+
+        started = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "bot:app", "-k", "uvicorn.workers.UvicornWorker",
+             "--workers", "1", "--bind", f"127.0.0.1:{app_port}", "--log-level", "warning"],
+            cwd=HERE, env=env, stderr=subprocess.DEVNULL,
+        )
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=30) as client:
+                while True:
+                    try:
+                        if (await client.get("/")).status_code == 200:
+                            break
+                    except httpx.TransportError:
+                        pass
+                    await asyncio.sleep(0.005)
+                first_ok.append(time.perf_counter() - started)
+                # What the first user after a cold start waits for: their update answered
+                uid = str(900000000 + run)
+                waiter = loop.create_future()
+                FAKE_API_WAITERS[uid].append(waiter)
+                resp = await client.post(f"/{os.environ['BOT_TOKEN']}", json=fake_update(run + 1, uid, "/start"))
+                assert resp.status_code == 200, resp.status_code
+                await asyncio.wait_for(waiter, 30)
+                first_reply.append(time.perf_counter() - started)
+        finally:
+            proc.terminate()
+            proc.wait()
+        print(f"run {run + 1}: import {imports[-1] * 1000:.0f} ms, first 200 {first_ok[-1] * 1000:.0f} ms, "
+              f"first reply {first_reply[-1] * 1000:.0f} ms")
+    api.should_exit = True
+    median = lambda xs: sorted(xs)[len(xs) // 2] * 1000
+    print(f"startup over {args.runs} runs (Bot API round trip {args.api_latency * 1000:.0f} ms), medians:")
+    print(f"  import bot:                   {median(imports):.0f} ms")
+    print(f"  launch to first 200 on /:     {median(first_ok):.0f} ms")
+    print(f"  launch to first update reply: {median(first_reply):.0f} ms")
+    print(f"  setWebhook calls: {FAKE_API_CALLS['setWebhook']}, getWebhookInfo calls: {FAKE_API_CALLS['getWebhookInfo']}")
+    return 0
+
+
+# ------------------------
+# Update dispatch: concurrency, per-user order, redelivery
+# ------------------------
+async def bench_updates(args):
+    """Push bursts of updates through the webhook at each UPDATE_CONCURRENCY level.
+
+    Every user sends a bonus_claim (delivered twice with the same
+    update_id, as Telegram does on a slow webhook), then two button
+    presses. Checks that each user's updates ran one at a time in
+    update_id order, that redeliveries were dropped, and that every user
+    got exactly one bonus with a balance matching their ledger.
+    """
+    from telegram.ext import Application
+    global FAKE_API_DELAY
+    FAKE_API_DELAY = args.api_latency
+    api_port = 18772
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{api_port}/bot"
+    api = await start_fake_api(api_port)
+    bot = load_bot()
+
+    order = defaultdict(list)  # user -> update_ids in the order they started
+    running = set()
+    overlaps = [0]
+    peak = [0]  # most updates running at once
+    original = Application.process_update
+
+    async def recording(self, update):
+        # the handlers' run, i.e. what the update processor let through
+        key = update.effective_user.id
+        if key in running:
+            overlaps[0] += 1
+        running.add(key)
+        peak[0] = max(peak[0], len(running))
+        order[key].append(update.update_id)
+        try:
+            await original(self, update)
+        finally:
+            running.discard(key)
+
+    Application.process_update = recording
+    update_id = 0
+    failed = 0
+    for level, concurrency in enumerate(int(n) for n in args.levels.split(",")):
+        bot.UPDATE_CONCURRENCY = concurrency  # read when tg_app is built on startup
+        order.clear()
+        overlaps[0] = 0
+        peak[0] = 0
+        dropped = bot.update_dedup.duplicates
+        users = [str(800000000 + level * 100000 + i) for i in range(args.users)]
+        steps = ([], [], [])  # bonus claim, then two buttons, each step across all users
+        for uid in users:
+            for step, text in zip(steps, (None, "💵 Balance", "👥 Refer & Earn")):
+                update_id += 1
+                step.append(fake_update(update_id, uid, text, callback_data=None if text else "bonus_claim"))
+        # Users interleaved the way a busy webhook sees them; each claim is redelivered once
+        payloads = steps[0] + steps[0] + steps[1] + steps[2]
+
+        async with bot.app.test_app() as test_app:
+            client = test_app.test_client()
+            application = await bot.ready_tg_app()
+            started = time.perf_counter()
+            for payload in payloads:
+                resp = await client.post(f"/{bot.BOT_TOKEN}", json=payload)
+                assert resp.status_code == 200, resp.status_code
+            await application.update_queue.join()
+            elapsed = time.perf_counter() - started
+
+        processed = sum(len(ids) for ids in order.values())
+        out_of_order = sum(1 for ids in order.values() if ids != sorted(ids))
+        db = bot.user_store.connect()
+        bonus_counts = dict(db.execute(
+            "SELECT user_id, COUNT(*) FROM ledger WHERE kind IN (?, ?) AND user_id >= ? AND user_id <= ? GROUP BY user_id",
+            (bot.ledger.BONUS_BOTH, bot.ledger.BONUS_ONE_GROUP, users[0], users[-1]),
+        ).fetchall())
+        wrong_bonus = sum(1 for uid in users if bonus_counts.get(uid) != 1)
+        drifted = db.execute(
+            "SELECT COUNT(*) FROM users u WHERE u.user_id >= ? AND u.user_id <= ? "
+            "AND ROUND(u.balance, 2) != ROUND((SELECT COALESCE(SUM(amount), 0) FROM ledger l WHERE l.user_id = u.user_id), 2)",
+            (users[0], users[-1]),
+        ).fetchone()[0]
+        failed |= bool(out_of_order or overlaps[0] or wrong_bonus or drifted or peak[0] > concurrency)
+        print(f"UPDATE_CONCURRENCY={concurrency}: {processed} updates from {len(users)} users in {elapsed:.2f}s, "
+              f"{processed / elapsed:.0f} updates/s, at most {peak[0]} at once")
+        print(f"  redeliveries dropped {bot.update_dedup.duplicates - dropped}, out-of-order users {out_of_order}, "
+              f"same-user overlaps {overlaps[0]}, wrong bonus count {wrong_bonus}, balance != ledger {drifted}")
+    Application.process_update = original
+    api.should_exit = True
+    return 1 if failed else 0
+
+
+async def bench_reminders(args):
+    """Walk a simulated day of bonus reminders at each user-base size.
+
+    Every user claimed a bonus at a random time in the last 24 hours (give
+    or take the few minutes seeding takes), so every user has a reminder
+    pending. Compares the heap scheduler's tick
+    (sync new rows + pop what is due) against one scan of last_bonus, and
+    checks every user is reminded exactly once.
+    """
+    from reminders import BonusReminders
+    from store import open_store
+    tick = 5.0
+    failed = 0
+    for size in (int(n) for n in args.sizes.split(",")):
+        store = open_store(f"sqlite:{os.path.join(TMP_DIR, f'reminders-{size}.db')}")
+        seed_users(store, size)
+        now = time.time()
+        with store.transaction() as db:
+            db.execute(
+                "UPDATE users SET last_bonus = strftime('%Y-%m-%dT%H:%M:%f', ? - (abs(random()) % 86000000) / 1000.0, 'unixepoch')",
+                (now,),
+            )
+        started = time.perf_counter()
+        reminders = BonusReminders(store, lambda chat_id, text: True, "ready", cooldown=86400.0)
+        backfilled = time.perf_counter() - started
+        started = time.perf_counter()
+        reminders._sync()
+        rebuilt = time.perf_counter() - started
+
+        ticks = int(86400 / tick) + 1
+        reminded = set()
+        tick_times = []
+        for t in range(ticks):
+            started = time.perf_counter()
+            reminders._sync()
+            due = reminders._pop_due(now + t * tick)
+            tick_times.append(time.perf_counter() - started)
+            reminded.update(user_id for user_id, _ in due)
+        db = store.connect()
+        scan_times = []
+        for t in range(20):
+            started = time.perf_counter()
+            since = datetime.utcfromtimestamp(now + t * tick - 86400).isoformat()
+            db.execute("SELECT user_id FROM users WHERE last_bonus <= ?", (since,)).fetchall()
+            scan_times.append(time.perf_counter() - started)
+        store.close()
+        tick_times.sort()
+        scan_times.sort()
+
+        missed = size - len(reminded)
+        failed |= bool(missed or reminders.pending())
+        print(f"{size} users: backfill {backfilled * 1000:.0f} ms, heap rebuild {rebuilt * 1000:.0f} ms, "
+              f"{size / ticks:.1f} reminders due per {tick:.0f}s tick")
+        print(f"  heap tick p50 {percentile(tick_times, 50) * 1e6:.0f} µs, p99 {percentile(tick_times, 99) * 1e6:.0f} µs; "
+              f"last_bonus scan p50 {percentile(scan_times, 50) * 1e6:.0f} µs; not reminded {missed}")
+    return 1 if failed else 0
+
+
+async def bench_sweep(args):
+    """Membership sweep at each user-base size: batch query cost by position, and the API budget.
+
+    A third of the seeded users have joined_groups set, with random claim
+    times. get_chat_member is answered in-process (1 in 50 users has left
+    a group), so the numbers are the sweep's own cost and pacing.
+    """
+    from types import SimpleNamespace
+    from membership import MembershipChecker, MembershipSweeper
+    from store import open_store
+
+    class FakeBot:
+        calls = 0
+
+        async def get_chat_member(self, chat_id, user_id):
+            FakeBot.calls += 1
+            await asyncio.sleep(0.01)
+            return SimpleNamespace(status="left" if user_id % 50 == 0 and chat_id == "@g2" else "member")
+
+    punished = []
+
+    async def on_punish(user_id, balance):
+        punished.append(user_id)
+
+    failed = 0
+    for size in (int(n) for n in args.sizes.split(",")):
+        store = open_store(f"sqlite:{os.path.join(TMP_DIR, f'sweep-{size}.db')}")
+        seed_users(store, size)
+        with store.transaction() as db:
+            db.execute(
+                "UPDATE users SET last_bonus = strftime('%Y-%m-%dT%H:%M:%f', ? - (abs(random()) % 2592000000) / 1000.0, "
+                "'unixepoch') WHERE joined_groups = 1",
+                (time.time(),),
+            )
+        sweeper = MembershipSweeper(store, MembershipChecker(), ["@g1", "@g2"], budget=args.budget, batch=20)
+        joined = store.connect().execute("SELECT COUNT(*) FROM users WHERE joined_groups = 1").fetchone()[0]
+        keys = store.connect().execute(
+            "SELECT COALESCE(last_bonus, ''), user_id FROM users WHERE joined_groups = 1 "
+            "ORDER BY COALESCE(last_bonus, '') DESC, user_id DESC"
+        ).fetchall()
+        timings = []
+        for position in (None, 0.5, 0.99):
+            cursor = None if position is None else tuple(keys[int(len(keys) * position)])
+            started = time.perf_counter()
+            for _ in range(100):
+                sweeper._next_batch(cursor)
+            timings.append((time.perf_counter() - started) / 100)
+
+        FakeBot.calls = 0
+        punished.clear()
+        task = asyncio.create_task(sweeper.run(FakeBot(), on_punish))
+        await asyncio.sleep(args.timeout)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        per_minute = FakeBot.calls / args.timeout * 60
+        expected = sum(1 for uid in punished if int(uid) % 50 == 0)
+        store.close()
+        failed |= bool(per_minute > args.budget * 1.05 + 2 * 60 / args.timeout or expected != len(punished))
+        print(f"{size} users ({joined} joined): next batch at start {timings[0] * 1e6:.0f} µs, "
+              f"middle {timings[1] * 1e6:.0f} µs, end {timings[2] * 1e6:.0f} µs")
+        print(f"  {FakeBot.calls} get_chat_member calls in {args.timeout:.0f}s = {per_minute:.0f}/min "
+              f"(budget {args.budget:.0f}), {sweeper.checked} users checked, {len(punished)} punished")
+    return 1 if failed else 0
+
+
+BENCHMARKS = {
+    "watched": bench_watched,
+    "ad_page": bench_ad_page,
+    "ad_pick": bench_ad_pick,
+    "ratelimit": bench_ratelimit,
+    "media": bench_media,
+    "workers": bench_workers,
+    "load": bench_load,
+    "startup": bench_startup,
+    "updates": bench_updates,
+    "reminders": bench_reminders,
+    "sweep": bench_sweep,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("bench", choices=sorted(BENCHMARKS))
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--workers", default="1,2,4", help="gunicorn worker counts to compare")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="user-base sizes for the load test")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for a reply to an update")
+    parser.add_argument("--runs", type=int, default=5, help="cold starts to time")
+    parser.add_argument("--levels", default="1,8,64", help="UPDATE_CONCURRENCY values to compare")
+    parser.add_argument("--budget", type=float, default=600, help="MEMBER_SWEEP_BUDGET for the sweep (calls/min)")
+    parser.add_argument("--api-latency", type=float, default=0.15, help="simulated Bot API round trip in seconds")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(BENCHMARKS[args.bench](args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 # bot.py — Telegram Mini App with MP4 Ads + Auto Reward + Bonus + Admin Control
 import os
+import math
 import random
 import asyncio
-import json
 import logging
-import nest_asyncio
+import tempfile
+import time
+import functools
+from collections import Counter
 from datetime import datetime, timedelta
-from flask import Flask, request, render_template_string
+from quart import Quart, request
 from telegram import (
     Update,
     InlineKeyboardButton,
@@ -16,14 +19,35 @@ from telegram import (
 )
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
     ContextTypes,
+    TypeHandler,
     filters,
 )
+from telegram.request import HTTPXRequest
+import ledger
+from adinventory import AdInventory
+from adpage import AdPageCache
+from auditlog import AdminLog
+from broadcast import BroadcastEngine
+from dispatch import PerUserProcessor, UpdateDedup
+from export import COMPRESSIONS, FORMATS, export_users
+from iostats import io_stats
+from lease import Lease
+from media import AdMedia
+from membership import MembershipChecker, MembershipSweeper
+from metrics import metrics
+from outbox import Outbox
+from profiler import StackSampler
+from ratelimit import RateLimiter, SQLiteBackend, parse_limits
+from referral import Referrals
+from reminders import BonusReminders
+from viewtokens import ViewTokens
+from store import open_store
 
-nest_asyncio.apply()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -31,6 +55,7 @@ logger = logging.getLogger(__name__)
 # 🔧 Configuration
 # ------------------------
 BOT_TOKEN = os.getenv("BOT_TOKEN")  # must be set in environment
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")  # point at a fake Bot API for load tests
 DOMAIN = os.getenv("DOMAIN", "https://yserfbuyebfsuye.onrender.com")  # update to your render domain
 
 # Groups to check (use the @username or t.me/username)
@@ -38,85 +63,247 @@ GROUP1_HANDLE = "@looteverythingfast"
 GROUP2_HANDLE = "@looteverythingfast2"
 
 GROUPS = [
-    {"name": "Loot Everything Fast", "url": f"https://t.me/{GROUP1_HANDLE.lstrip('@')}"},
-    {"name": "Loot Everything Fast 2", "url": f"https://t.me/{GROUP2_HANDLE.lstrip('@')}"}
+    {"name": "Loot Everything Fast", "handle": GROUP1_HANDLE, "url": f"https://t.me/{GROUP1_HANDLE.lstrip('@')}"},
+    {"name": "Loot Everything Fast 2", "handle": GROUP2_HANDLE, "url": f"https://t.me/{GROUP2_HANDLE.lstrip('@')}"}
 ]
+GROUP_LINKS = "".join(f"👉 {g['url']}\n" for g in GROUPS)
 
-AD_LINKS = [
-    {"video_url": "https://res.cloudinary.com/dxatgmpv7/video/upload/v1762335977/ad1.mp4_pepcsc.mp4"},
-    {"video_url": "https://res.cloudinary.com/dxatgmpv7/video/upload/v1762336514/ad2.mp4_dnuqew.mp4"}
-]
+BONUS_COOLDOWN = timedelta(hours=24)
+
+# Deducted from users who took the ₹50 bonus and left a group (₹50 back + ₹10 penalty)
+PUNISH_AMOUNT = 60
+PUNISH_TEXT = (
+    "⚠️ Don't be oversmart! You have not joined the groups.\n"
+    f"₹{PUNISH_AMOUNT} deducted (₹50 bonus + ₹10 penalty for cheating)."
+)
+
+# Ads, weights and caps live in ads.json and are picked up without a restart. Per ad:
+# "file" (optional) is a copy in static/ served by /media; "video_url" is the CDN copy
+AD_CONFIG = os.getenv("AD_CONFIG", "ads.json")
+AD_COUNTER_FLUSH_SECONDS = float(os.getenv("AD_COUNTER_FLUSH_SECONDS", "10"))
+
+USER_FILE = "users.json"  # legacy store, imported once into the user store
+USER_STORE = os.getenv("USER_STORE", "sqlite:users.db")
+
+user_store = open_store(USER_STORE)
+user_store.migrate_from_json(USER_FILE)
+
+# gunicorn -w N: every worker imports this module. Shared state lives in the
+# user store (SQLite WAL); one-per-deployment jobs run on the lease holder.
+# Rate limits and update dedup are shared too however the worker count is set;
+# SHARED_STATE=0 keeps them in process memory, which only suits a single worker.
+SHARED_STATE = os.getenv("SHARED_STATE", "1") == "1"
+leader = Lease(user_store, "leader", ttl=float(os.getenv("LEADER_LEASE_SECONDS", "30")))
+
+# Outgoing notifications (sent from tg_app's loop by a fixed worker pool)
+outbox = Outbox(
+    maxsize=int(os.getenv("OUTBOX_SIZE", "10000")),
+    workers=int(os.getenv("OUTBOX_WORKERS", "8")),
+)
+
+# Background broadcasts, rate-limited below Telegram's global limit
+broadcaster = BroadcastEngine(
+    user_store,
+    rate=float(os.getenv("BROADCAST_RATE", "25")),
+    concurrency=int(os.getenv("BROADCAST_CONCURRENCY", "10")),
+)
+
+# "Bonus ready" messages when a claim's cooldown runs out, sent by the leader
+BONUS_REMINDERS = os.getenv("BONUS_REMINDERS", "1") == "1"
+bonus_reminders = BonusReminders(
+    user_store,
+    outbox.send,
+    "🎁 Aapka bonus ready hai! Menu me '🎁 Bonus' dabaye aur claim karein.",
+    cooldown=BONUS_COOLDOWN.total_seconds(),
+    rate=float(os.getenv("BONUS_REMINDER_RATE", "10")),
+)
+
+# get_chat_member answers cached per (group, user); "left" expires quickly
+membership = MembershipChecker(
+    ttl_positive=float(os.getenv("MEMBER_TTL_POSITIVE", "600")),
+    ttl_negative=float(os.getenv("MEMBER_TTL_NEGATIVE", "20")),
+)
+
+# Leader-side re-check of users paid for joining; leavers get the /punish deduction.
+# MEMBER_SWEEP_BUDGET caps its get_chat_member calls per minute.
+MEMBER_SWEEP = os.getenv("MEMBER_SWEEP", "1") == "1"
+membership_sweeper = MembershipSweeper(
+    user_store,
+    membership,
+    [g["handle"] for g in GROUPS],
+    budget=float(os.getenv("MEMBER_SWEEP_BUDGET", "60")),
+    batch=int(os.getenv("MEMBER_SWEEP_BATCH", "20")),
+    amount=PUNISH_AMOUNT,
+    pause=float(os.getenv("MEMBER_SWEEP_PAUSE_SECONDS", "3600")),
+)
+
+ad_inventory = AdInventory(AD_CONFIG, user_store)
 
-USER_FILE = "users.json"
-if not os.path.exists(USER_FILE):
-    with open(USER_FILE, "w") as f:
-        json.dump({}, f)
+# Ad videos: local copy or CDN, whichever is preferred and healthy (MEDIA_PREFER=local|remote)
+media = AdMedia("static", prefer=os.getenv("MEDIA_PREFER", "local"))
+MEDIA_CHECK_SECONDS = float(os.getenv("MEDIA_CHECK_SECONDS", "60"))
+
+# Each ad page view mints a single-use token that /watched must redeem
+view_tokens = ViewTokens(
+    user_store,
+    ttl=float(os.getenv("VIEW_TOKEN_TTL", "3600")),
+    min_watch=float(os.getenv("MIN_WATCH_SECONDS", "10")),
+)
 
-def load_users():
-    with open(USER_FILE, "r") as f:
-        return json.load(f)
+# Per-action limits as "action=count/seconds"; "global" caps all actions combined.
+# ad_page, ad_token and watched_ip are per client address and loose, since carrier NAT
+# puts many users behind one IP; watched is per user, counted once a view token is redeemed.
+# RATE_LIMIT_BACKEND=sqlite shares the counters between gunicorn workers (the default unless SHARED_STATE=0).
+RATE_LIMITS = parse_limits(os.getenv(
+    "RATE_LIMITS",
+    "ad=6/60,bonus=5/60,message=30/60,command=20/60,callback=30/60,"
+    "ad_page=300/60,ad_token=300/60,watched_ip=300/60,watched=10/60,global=1000/1",
+))
+rate_limiter = RateLimiter(
+    RATE_LIMITS,
+    SQLiteBackend(user_store)
+    if os.getenv("RATE_LIMIT_BACKEND", "sqlite" if SHARED_STATE else "memory") == "sqlite"
+    else None,
+)
 
-def save_users(data):
-    with open(USER_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+# Redelivered updates (same update_id) are dropped at the webhook; unless
+# SHARED_STATE=0 the ids are also claimed in the shared database. Updates from different
+# users run concurrently (up to UPDATE_CONCURRENCY), each user's in order; with
+# WEB_CONCURRENCY>1 that order only holds among the updates one worker receives.
+update_dedup = UpdateDedup(
+    window=int(os.getenv("UPDATE_DEDUP_WINDOW", "10000")),
+    store=user_store if SHARED_STATE else None,
+)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+
+# /start <referrer_id> pays the referrer once per new user
+REFERRAL_REWARD = float(os.getenv("REFERRAL_REWARD", "5"))
+referrals = Referrals(user_store, REFERRAL_REWARD)
+
+async def send_export(message, args=()):
+    """Stream a compressed snapshot of the user store and send it as document(s).
+
+    args may hold a format (jsonl/csv), a compression (gz/zst) and an ISO
+    timestamp; with a timestamp only users changed since then are exported.
+    """
+    fmt, compression, since = "jsonl", "gz", None
+    for arg in args:
+        if arg in FORMATS:
+            fmt = arg
+        elif arg in COMPRESSIONS:
+            compression = arg
+        else:
+            since = datetime.fromisoformat(arg).isoformat()
+    with tempfile.TemporaryDirectory() as out_dir:
+        # File I/O and compression run in a worker thread, not on the loop
+        paths = await asyncio.to_thread(export_users, user_store.path, out_dir, fmt, compression, since)
+        for path in paths:
+            with open(path, "rb") as f:
+                await message.reply_document(document=f, filename=os.path.basename(path))
+    return paths
 
 # ------------------------
-# 🌐 Flask App
+# 🌐 Web App (ASGI — serve with: gunicorn -k uvicorn.workers.UvicornWorker bot:app)
 # ------------------------
-app = Flask(__name__)
+app = Quart(__name__)
+
+# index.html is compiled once; set AD_TEMPLATE_AUTO_RELOAD=1 to pick up edits without a restart
+ad_pages = AdPageCache("index.html", auto_reload=os.getenv("AD_TEMPLATE_AUTO_RELOAD") == "1")
+
+# Proxies in front of us that append to X-Forwarded-For (Render has one). Hops before
+# theirs come from the client and can be anything, so they are never used as a key.
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "1"))
+
+def client_key():
+    """The client's address as seen by the outermost trusted proxy."""
+    hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+    if TRUSTED_PROXIES and hops:
+        return hops[-min(TRUSTED_PROXIES, len(hops))]
+    return request.remote_addr or ""
+
+def rate_limited(action, key=client_key):
+    """Answer 429 once `key()` exceeds the action's limit, before the route runs."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            retry = await rate_limiter.check(action, key())
+            if retry:
+                headers = {"Retry-After": str(math.ceil(retry))}
+                return {"status": "error", "message": "Too many requests"}, 429, headers
+            return await func(*args, **kwargs)
+        return wrapper
+    return decorator
 
 @app.route("/")
 def home():
     return "✅ Telegram Ad Bot is running!"
 
 @app.route("/ad/<int:ad_id>")
-def ad_page(ad_id):
-    if 0 <= ad_id < len(AD_LINKS):
-        ad = AD_LINKS[ad_id]
-        with open("index.html", "r", encoding="utf-8") as f:
-            html = f.read()
-        return render_template_string(
-            html,
-            video_src=ad["video_url"],
-            domain=DOMAIN,
-            ad_id=ad_id,
-            user_id=request.args.get("user_id", "")
-        )
+@rate_limited("ad_page")
+@io_stats.track
+async def ad_page(ad_id):
+    ad = ad_inventory.get(ad_id)
+    if ad is not None:
+        context = {"video_src": media.video_src(ad, DOMAIN), "domain": DOMAIN}
+        html, etag = ad_pages.render(ad_id, **context)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in request.headers.get("If-None-Match", ""):
+            return "", 304, headers
+        return html, 200, headers
     return "Invalid Ad ID", 404
 
+@app.route("/ad/<int:ad_id>/token", methods=["POST"])
+@rate_limited("ad_token")  # per client address: user_id is whatever the caller sends
+@io_stats.track
+async def ad_token(ad_id):
+    # The page fetches its single-use view token here, so the page itself stays cacheable
+    data = await request.get_json(silent=True) or {}
+    user_id = str(data.get("user_id") or "")
+    if ad_inventory.get(ad_id) is None:
+        return {"status": "error", "message": "Invalid Ad ID"}, 404
+    # Only users who have started the bot get a token (and count an impression)
+    if not user_id or await user_store.aget(user_id) is None:
+        return {"status": "error", "message": "Unknown user"}, 403
+    ad_inventory.impression(ad_id, user_id)
+    token = await view_tokens.mint(user_id, ad_id)
+    return {"status": "ok", "token": token}, 200, {"Cache-Control": "no-store"}
+
+@app.route("/media/<name>")
+async def media_file(name):
+    # Range requests, ETag revalidation and long-lived caching for ad videos
+    response = await media.serve(name, request)
+    if response is None:
+        return "Not found", 404
+    return response
+
 @app.route("/watched", methods=["POST"])
-def watched():
-    data = request.get_json()
+@rate_limited("watched_ip")
+@io_stats.track
+async def watched():
+    data = await request.get_json()
     logger.info("🎥 WATCHED EVENT: %s", data)
-    user_id = str(data.get("user_id"))
+    user_id = str(data.get("user_id") or "")
 
     if not user_id:
         return {"status": "error", "message": "No user_id provided"}, 400
 
-    users = load_users()
-    reward = round(random.uniform(3, 5), 2)
-
-    if user_id not in users:
-        users[user_id] = {"balance": 0.0, "joined_groups": False}
+    # Replays and retries are turned away here, before the user store is touched
+    ad_id, reason = await view_tokens.redeem(str(data.get("token") or ""), user_id)
+    if reason:
+        logger.info(f"🚫 /watched rejected for {user_id}: {reason}")
+        return {"status": "error", "message": reason}, 409
+    # Per user rather than per address: the redeemed token proves who is asking
+    retry = await rate_limiter.check("watched", user_id, count_global=False)
+    if retry:
+        return {"status": "error", "message": "Too many requests"}, 429, {"Retry-After": str(math.ceil(retry))}
+    ad_inventory.completion(ad_id)
 
-    users[user_id]["balance"] += reward
-    save_users(users)
-
-    async def notify_user():
-        try:
-            await tg_app.bot.send_message(
-                chat_id=int(user_id),
-                text=f"✅ Aapne ₹{reward} kamaye! Ad dekhne ka dhanyavaad 🎉"
-            )
-            await tg_app.bot.send_message(
-                chat_id=int(user_id),
-                text="📢 Please join both groups to claim your bonus in the Bonus section!"
-            )
-        except Exception as e:
-            logger.error(f"Error sending message: {e}")
+    reward = round(random.uniform(3, 5), 2)
+    await user_store.acredit(user_id, reward, ledger.AD_REWARD)
 
-    import threading
-    threading.Thread(target=lambda: asyncio.run(notify_user())).start()
+    # Both notices are merged into one message by the outbox
+    outbox.send(user_id, f"✅ Aapne ₹{reward} kamaye! Ad dekhne ka dhanyavaad 🎉")
+    outbox.send(user_id, "📢 Please join both groups to claim your bonus in the Bonus section!")
 
     return {"status": "ok", "reward": reward}, 200
 
@@ -124,6 +311,14 @@ def watched():
 # 🤖 Telegram Bot Logic
 # ------------------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.args:
+        referrer = context.args[0]
+        if await referrals.record(referrer, update.effective_user.id):
+            outbox.send(referrer, f"🎉 Naya referral! Aapko ₹{REFERRAL_REWARD} mile.")
+    # After the referral, which only counts users the store has never seen.
+    # The row makes them a referrer, a broadcast recipient and a /stats user.
+    await user_store.aregister(update.effective_user.id)
+
     keyboard = [
         ["▶️ Ad Dekhe", "💵 Balance"],
         ["👥 Refer & Earn", "🎁 Bonus"],
@@ -138,15 +333,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.from_user.id)
     text = update.message.text
-    users = load_users()
-
-    if user_id not in users:
-        users[user_id] = {"balance": 0.0, "joined_groups": False}
-        save_users(users)
+    # Read-only: unknown users get a default record that is never stored
+    user = await user_store.aget_or_default(user_id)
 
     if text == "▶️ Ad Dekhe":
-        ad_idx = random.randrange(len(AD_LINKS))
-        ad_url = f"{DOMAIN}/ad/{ad_idx}?user_id={user_id}"
+        ad = ad_inventory.pick(user_id)
+        if ad is None:
+            await update.message.reply_text("😴 Abhi koi ad available nahi hai. Thodi der baad try karein!")
+            return
+        ad_url = f"{DOMAIN}/ad/{ad['id']}?user_id={user_id}"
         kb = InlineKeyboardMarkup(
             [[InlineKeyboardButton("▶️ Ad Dekhe", web_app=WebAppInfo(url=ad_url))]]
         )
@@ -157,14 +352,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=kb
         )
 
-        if not users[user_id]["joined_groups"]:
+        if not user["joined_groups"]:
             group_text = "📢 Bonus Alert:\nKripya in dono groups ko join karein aur apna ₹50 bonus claim karein:\n\n"
             for g in GROUPS:
                 group_text += f"👉 [{g['name']}]({g['url']})\n"
             await update.message.reply_text(group_text, parse_mode="Markdown")
 
     elif text == "💵 Balance":
-        bal = round(users[user_id].get("balance", 0.0), 2)
+        bal = round(user.get("balance", 0.0), 2)
         await update.message.reply_text(f"💰 Available Balance: ₹{bal}")
 
     elif text == "🎁 Bonus":
@@ -173,17 +368,21 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ])
         await update.message.reply_text(
             "🎁 Join both groups below and press '✅ I Joined' to claim your ₹50 bonus:\n\n"
-            f"👉 {GROUPS[0]['url']}\n"
-            f"👉 {GROUPS[1]['url']}\n\n"
+            f"{GROUP_LINKS}\n"
             "After joining, press the button below 👇",
             reply_markup=kb,
             parse_mode="Markdown"
         )
 
     elif text == "👥 Refer & Earn":
-        bot_username = (await context.bot.get_me()).username
-        ref_link = f"https://t.me/{bot_username}?start={user_id}"
-        await update.message.reply_text(f"👥 Apna referral link share karein:\n{ref_link}")
+        # tg_app.initialize() fetched the bot's identity once; no get_me per press
+        ref_link = f"https://t.me/{context.bot.username}?start={user_id}"
+        referred, earned = await asyncio.to_thread(referrals.summary, user_id)
+        await update.message.reply_text(
+            f"👥 Apna referral link share karein:\n{ref_link}\n\n"
+            f"🙋 Referred users: {referred}\n"
+            f"💰 Referral earnings: ₹{earned} (₹{REFERRAL_REWARD} per referral)"
+        )
 
     elif text == "⚙️ Extra":
         await update.message.reply_text("⚙️ Extra options coming soon!")
@@ -193,25 +392,37 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # -------------------------------------------------
 async def handle_bonus_claim(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    # Immediately acknowledge the callback so the client unblocks
-    try:
-        await query.answer(text="Checking group membership...", show_alert=False)
-    except Exception as e:
-        logger.warning(f"query.answer failed: {e}")
-
     user_id = str(query.from_user.id)
-    users = load_users()
     now = datetime.utcnow()
 
-    # ensure user record exists
-    if user_id not in users:
-        users[user_id] = {"balance": 0.0, "joined_groups": False}
+    # Read only: the record is written (with the user's name) when a bonus is credited
+    user = await user_store.aget_or_default(user_id)
+    names = {"first_name": query.from_user.first_name or "", "username": query.from_user.username or ""}
 
-    # store identifying info
-    users[user_id]["first_name"] = query.from_user.first_name or ""
-    users[user_id]["username"] = query.from_user.username or ""
-    user = users[user_id]
+    # Cooldown first: a user still waiting costs one API call, not five
     last_bonus = user.get("last_bonus")
+    if last_bonus:
+        try:
+            last_bonus_dt = datetime.fromisoformat(last_bonus)
+        except Exception:
+            last_bonus_dt = now - BONUS_COOLDOWN
+        diff = now - last_bonus_dt
+        if diff < BONUS_COOLDOWN:
+            remaining = BONUS_COOLDOWN - diff
+            h = int(remaining.total_seconds() // 3600)
+            m = int((remaining.total_seconds() % 3600) // 60)
+            s = int(remaining.total_seconds() % 60)
+            try:
+                await query.answer(text=f"⏳ Please wait {h}h {m}m {s}s for your next bonus.", show_alert=True)
+            except Exception as e:
+                logger.error(f"Failed to send cooldown msg to {user_id}: {e}")
+            return
+
+    # Immediately acknowledge the callback so the client unblocks
+    try:
+        await query.answer(text="Checking group membership...", show_alert=False)
+    except Exception as e:
+        logger.warning(f"query.answer failed: {e}")
 
     # Try to change the button right away to show it's claimed (use edit_message_reply_markup)
     try:
@@ -222,49 +433,46 @@ async def handle_bonus_claim(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Not fatal — log and continue. This prevents the handler from crashing.
         logger.warning(f"Could not edit reply markup for {user_id}: {e}")
 
-    # Now check group membership with safe exceptions
-    group1_status = False
-    group2_status = False
-
-    try:
-        m1 = await context.bot.get_chat_member(chat_id="@looteverythingfast", user_id=int(user_id))
-        group1_status = m1.status in ["member", "administrator", "creator"]
-    except Exception as e:
-        logger.warning(f"Could not check membership for group1 for {user_id}: {e}")
-
-    try:
-        m2 = await context.bot.get_chat_member(chat_id="@looteverythingfast2", user_id=int(user_id))
-        group2_status = m2.status in ["member", "administrator", "creator"]
-    except Exception as e:
-        logger.warning(f"Could not check membership for group2 for {user_id}: {e}")
+    # Check every group concurrently (cached per group and user)
+    statuses = await membership.check_all(context.bot, [g["handle"] for g in GROUPS], user_id)
+    joined = sum(statuses)
 
     # CASE 1: Joined none
-    if not group1_status and not group2_status:
+    if joined == 0:
         try:
             await query.message.reply_text(
                 "🚫 You have not joined any of the required groups.\n\n"
                 "Join both groups and try again:\n\n"
-                "👉 https://t.me/looteverythingfast\n"
-                "👉 https://t.me/looteverythingfast2"
+                f"{GROUP_LINKS}"
             )
         except Exception as e:
             logger.error(f"Failed to send 'joined none' msg to {user_id}: {e}")
         logger.info(f"BONUS_NONE: user_id={user_id}")
         return
 
-    # CASE 2: Joined only one group -> give ₹25
-    if group1_status != group2_status:
-        user["joined_groups"] = False
-        user["joined_at"] = now.isoformat()
-        user["last_bonus"] = now.isoformat()
-        user["balance"] = user.get("balance", 0) + 25
-        save_users(users)
+    # The cooldown is re-checked inside the credit's transaction, so a double
+    # tap handled by two workers at once still pays only one bonus
+    cooldown_since = (now - BONUS_COOLDOWN).isoformat()
+
+    # CASE 2: Joined only some groups -> give ₹25
+    if joined < len(GROUPS):
+        balance = await user_store.acredit_if_idle(
+            user_id, 25, ledger.BONUS_ONE_GROUP, "last_bonus", cooldown_since,
+            joined_groups=False,
+            joined_at=now.isoformat(),
+            last_bonus=now.isoformat(),
+            **names,
+        )
+        if balance is None:
+            logger.info(f"BONUS_DUPLICATE: user_id={user_id}")
+            return
+        if BONUS_REMINDERS:
+            bonus_reminders.schedule(user_id, time.time() + BONUS_COOLDOWN.total_seconds())
         try:
             await query.message.reply_text(
                 "⚠️ You have joined only one group.\n"
                 "Please join both groups to earn full rewards next time:\n\n"
-                "👉 https://t.me/looteverythingfast\n"
-                "👉 https://t.me/looteverythingfast2\n\n"
+                f"{GROUP_LINKS}\n"
                 "✅ ₹25 bonus added!"
             )
         except Exception as e:
@@ -272,75 +480,65 @@ async def handle_bonus_claim(update: Update, context: ContextTypes.DEFAULT_TYPE)
         logger.info(f"BONUS_ONE_GROUP: user_id={user_id}")
         return
 
-    # CASE 3: Joined both groups -> handle 24h cooldown and add ₹50
-    if group1_status and group2_status:
-        if last_bonus:
-            try:
-                last_bonus_dt = datetime.fromisoformat(last_bonus)
-            except Exception:
-                last_bonus_dt = now - timedelta(days=1)
-            diff = now - last_bonus_dt
-            if diff < timedelta(hours=24):
-                remaining = timedelta(hours=24) - diff
-                h = int(remaining.total_seconds() // 3600)
-                m = int((remaining.total_seconds() % 3600) // 60)
-                s = int(remaining.total_seconds() % 60)
-                try:
-                    await query.message.reply_text(f"⏳ Please wait {h}h {m}m {s}s for your next bonus.")
-                except Exception as e:
-                    logger.error(f"Failed to send cooldown msg to {user_id}: {e}")
-                return
-
-        # Give ₹50
-        user["joined_groups"] = True
-        user["joined_at"] = user.get("joined_at") or now.isoformat()
-        user["last_bonus"] = now.isoformat()
-        user["balance"] = user.get("balance", 0) + 50
-        save_users(users)
-        try:
-            await query.message.reply_text(
-                "🎉 Thanks for joining both groups!\n"
-                "Stay active there for big loots 💥\n\n"
-                "✅ ₹50 bonus added!\n"
-                "⏳ Please wait 24 hours for your next bonus."
-            )
-        except Exception as e:
-            logger.error(f"Failed to send 'both groups' msg to {user_id}: {e}")
-        logger.info(f"BONUS_BOTH_GROUPS: user_id={user_id}")
+    # CASE 3: Joined all groups -> add ₹50
+    balance = await user_store.acredit_if_idle(
+        user_id, 50, ledger.BONUS_BOTH, "last_bonus", cooldown_since,
+        joined_groups=True,
+        joined_at=user.get("joined_at") or now.isoformat(),
+        last_bonus=now.isoformat(),
+        **names,
+    )
+    if balance is None:
+        logger.info(f"BONUS_DUPLICATE: user_id={user_id}")
         return
+    if BONUS_REMINDERS:
+        bonus_reminders.schedule(user_id, time.time() + BONUS_COOLDOWN.total_seconds())
+    try:
+        await query.message.reply_text(
+            "🎉 Thanks for joining both groups!\n"
+            "Stay active there for big loots 💥\n\n"
+            "✅ ₹50 bonus added!\n"
+            "⏳ Please wait 24 hours for your next bonus."
+        )
+    except Exception as e:
+        logger.error(f"Failed to send 'both groups' msg to {user_id}: {e}")
+    logger.info(f"BONUS_BOTH_GROUPS: user_id={user_id}")
 
 # ------------------------
 # Admin helper commands
 # ------------------------
 ADMIN_ID = int(os.getenv("8288030589", "0"))  # Set your admin numeric ID in env or replace here
+ADMIN_PAGE_SIZE = 20  # rows per reply for /find and /list_claimers
+
+def split_page_arg(args):
+    """Split a trailing page number off command args: ['john', '2'] -> (['john'], 2)."""
+    if len(args) > 1 and args[-1].isdigit():
+        return args[:-1], max(int(args[-1]), 1)
+    return args, 1
 
 async def list_claimers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
         await update.message.reply_text("❌ Not authorized.")
         return
 
+    # /list_claimers [n] [page]
     args = context.args or []
-    n = int(args[0]) if args and args[0].isdigit() else 10
-    users = load_users()
-
-    items = []
-    for uid, info in users.items():
-        if info.get("joined_groups") or info.get("joined_at"):
-            joined = info.get("joined_at") or ""
-            items.append((joined, uid, info))
-    items.sort(reverse=True)
-    items = items[:n]
+    n = min(int(args[0]), ADMIN_PAGE_SIZE) if args and args[0].isdigit() else 10
+    page = int(args[1]) if len(args) > 1 and args[1].isdigit() and int(args[1]) > 0 else 1
 
+    items = await asyncio.to_thread(user_store.recent_claimers, n, (page - 1) * n)
     if not items:
         await update.message.reply_text("No claimers found.")
         return
 
     lines = []
-    for joined, uid, info in items:
+    for uid, info in items:
         uname = f"@{info.get('username')}" if info.get("username") else "-"
         fname = info.get("first_name", "-")
         bal = info.get("balance", 0)
-        lines.append(f"{uid}  | {uname} | {fname} | joined: {joined or '-'} | bal: ₹{bal}")
+        lines.append(f"{uid}  | {uname} | {fname} | joined: {info.get('joined_at') or '-'} | bal: ₹{bal}")
+    if len(items) == n:
+        lines.append(f"\nNext page: /list_claimers {n} {page + 1}")
     await update.message.reply_text("\n".join(lines))
 
 async def find_claimer(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -349,15 +547,12 @@ async def find_claimer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if not context.args:
-        await update.message.reply_text("Usage: /find <substring>")
+        await update.message.reply_text("Usage: /find <substring> [page]")
         return
 
-    q = " ".join(context.args).lower()
-    users = load_users()
-    matches = []
-    for uid, info in users.items():
-        if q in (info.get("username") or "").lower() or q in (info.get("first_name") or "").lower():
-            matches.append((uid, info))
+    words, page = split_page_arg(context.args)
+    q = " ".join(words)
+    matches = await asyncio.to_thread(user_store.search, q, ADMIN_PAGE_SIZE, (page - 1) * ADMIN_PAGE_SIZE)
     if not matches:
         await update.message.reply_text("No matches found.")
         return
@@ -369,6 +564,8 @@ async def find_claimer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         bal = info.get("balance", 0)
         joined = info.get("joined_at", "-")
         lines.append(f"{uid} | {uname} | {fname} | joined: {joined} | bal: ₹{bal}")
+    if len(matches) == ADMIN_PAGE_SIZE:
+        lines.append(f"\nNext page: /find {q} {page + 1}")
     await update.message.reply_text("\n".join(lines))
 
 async def punish(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -381,16 +578,12 @@ async def punish(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     key = context.args[0].lstrip("@")
-    users = load_users()
 
     # numeric id
     if key.isdigit():
         target_id = key
     else:
-        found = []
-        for uid, info in users.items():
-            if info.get("username") and info["username"].lower() == key.lower():
-                found.append(uid)
+        found = await asyncio.to_thread(user_store.find_by_username, key)
         if len(found) == 0:
             await update.message.reply_text("No user with that username found in DB.")
             return
@@ -399,47 +592,138 @@ async def punish(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         target_id = found[0]
 
-    if target_id not in users:
+    balance = await user_store.adebit(target_id, PUNISH_AMOUNT, ledger.PUNISH)
+    if balance is None:
         await update.message.reply_text("User not found in DB.")
         return
 
-    users[target_id]["balance"] = users[target_id].get("balance", 0) - 60
-    save_users(users)
     try:
-        await context.bot.send_message(
-            chat_id=int(target_id),
-            text="⚠️ Don't be oversmart! You have not joined the groups.\n₹60 deducted (₹50 bonus + ₹10 penalty for cheating)."
-        )
+        await context.bot.send_message(chat_id=int(target_id), text=PUNISH_TEXT)
     except Exception as e:
         logger.error(f"Failed to message punished user: {e}")
-    await update.message.reply_text(f"✅ Deducted ₹60 from {target_id}. Current balance: ₹{users[target_id].get('balance',0)}")
+    await update.message.reply_text(f"✅ Deducted ₹{PUNISH_AMOUNT} from {target_id}. Current balance: ₹{balance}")
+    log_admin_action("CMD_punish", update.effective_user.id, target=target_id, amount=PUNISH_AMOUNT)
+
+async def punished_by_sweep(user_id, balance):
+    # Same message as /punish; the audit log shows it came from the sweep, not an admin
+    outbox.send(user_id, PUNISH_TEXT)
+    log_admin_action("AUTO_punish", None, target=user_id, amount=PUNISH_AMOUNT, balance=balance)
+
+# ------------------------
+# 🚦 Rate limiting (runs before every other handler)
+# ------------------------
+RATE_LIMITED_TEXTS = {"▶️ Ad Dekhe": "ad", "🎁 Bonus": "bonus"}
+
+def update_action(update: Update):
+    """Map an update to the rate-limit action it counts against."""
+    if update.callback_query:
+        return "bonus" if update.callback_query.data == "bonus_claim" else "callback"
+    text = update.effective_message.text if update.effective_message else None
+    if text and text.startswith("/"):
+        return "command"
+    return RATE_LIMITED_TEXTS.get(text, "message")
+
+async def rate_limit_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user is None or user.id == ADMIN_ID:
+        return
+    retry = await rate_limiter.check(update_action(update), user.id)
+    if not retry:
+        return
+    if update.callback_query:
+        # Callback buttons keep spinning until answered
+        await update.callback_query.answer(f"⏳ Too many requests. Try again in {math.ceil(retry)}s.")
+    raise ApplicationHandlerStop
 
 # ------------------------
 # 🔔 Webhook Integration and App start
 # ------------------------
-tg_app = Application.builder().token(BOT_TOKEN).build()
-tg_app.add_handler(CommandHandler("start", start))
-tg_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-tg_app.add_handler(CallbackQueryHandler(handle_bonus_claim, pattern="bonus_claim"))
-tg_app.add_handler(CommandHandler("list_claimers", list_claimers))
-tg_app.add_handler(CommandHandler("find", find_claimer))
-tg_app.add_handler(CommandHandler("punish", punish))
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that times every Bot API call under its method name (see /metrics)."""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        metrics.begin("bot_api", api_method)
+        started = time.perf_counter()
+        status = None
+        try:
+            status, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            return status, payload
+        finally:
+            metrics.end("bot_api", api_method, time.perf_counter() - started, status is None or status >= 400)
+
+# tg_app is built on first use, not at import: its HTTP clients (httpcore, SSL
+# contexts) are the slowest part of a cold start and "/" doesn't need them
+tg_app = None
+HANDLERS = []  # (handler, group) in registration order
+
+def add_handler(handler, group=0):
+    """Queue a handler; build_tg_app() registers them all on tg_app."""
+    # Wrapped once, here: count store reads/writes (see /iostats) and time it (see /metrics) under its name
+    handler.callback = metrics.track(
+        io_stats.track(handler.callback), "handler", handler.callback.__name__,
+        expected=(ApplicationHandlerStop,),
+    )
+    HANDLERS.append((handler, group))
+
+add_handler(TypeHandler(Update, rate_limit_updates), group=-1)
+add_handler(CommandHandler("start", start))
+add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+add_handler(CallbackQueryHandler(handle_bonus_claim, pattern="bonus_claim"))
+add_handler(CommandHandler("list_claimers", list_claimers))
+add_handler(CommandHandler("find", find_claimer))
+add_handler(CommandHandler("punish", punish))
 
 # ------------------------
-# 🧠 Admin Power Panel (INLINE) — paste AFTER tg_app definition
+# 🧠 Admin Power Panel (INLINE) — paste AFTER add_handler definition
 # ------------------------
 ADMIN_ID = 8288030589  # your admin numeric id
 
-ADMIN_LOG_FILE = "admin_actions.log"
+ADMIN_LOG_FILE = os.getenv("ADMIN_LOG_FILE", "admin_actions.log")
+ADMIN_LOG_TAIL = 50
 
-def log_admin_action(text: str):
-    """Append an admin action to admin_actions.log with timestamp."""
+admin_log = AdminLog(
+    ADMIN_LOG_FILE,
+    max_bytes=int(os.getenv("ADMIN_LOG_MAX_BYTES", str(5 * 1024 * 1024))),
+    rotate_every=timedelta(hours=float(os.getenv("ADMIN_LOG_ROTATE_HOURS", "24"))),
+    keep=int(os.getenv("ADMIN_LOG_KEEP", "10")),
+)
+
+def log_admin_action(action: str, admin_id: int, target=None, **details):
+    """Queue a structured admin action for the audit log (admin_actions.log); never blocks on disk."""
     try:
-        with open(ADMIN_LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"{datetime.utcnow().isoformat()}  {text}\n")
+        admin_log.log(action, admin_id, target, **details)
     except Exception as e:
         logger.error(f"Failed to write admin log: {e}")
 
+async def recent_admin_actions(n=ADMIN_LOG_TAIL, **criteria):
+    """Render the newest n audit entries (newest first) as a /logs reply."""
+    entries = await asyncio.to_thread(admin_log.tail, n, **criteria)
+    if not entries:
+        return "No admin logs found."
+    text = "🧾 Recent admin actions:\n\n" + "\n".join(AdminLog.format(e) for e in entries)
+    return text[:4000]  # Telegram caps messages at 4096 chars
+
+async def stats_text():
+    """Format the running aggregates (O(1), no scan over users) for /stats and the panel."""
+    st = await asyncio.to_thread(user_store.stats.snapshot)
+    return (
+        f"📊 Stats\n\n"
+        f"Total users: {st['total_users']}\n"
+        f"Users joined both groups: {st['joined_both']}\n"
+        f"Total balance (all users): ₹{st['total_balance']}\n"
+        f"Ads watched today: {st['ads_watched_today']}\n"
+        f"Bonuses paid today: {st['bonuses_paid_today']} (₹{st['bonus_amount_today']})\n"
+    )
+
+def iostats_text():
+    """Per-handler user store traffic since this process started."""
+    lines = [
+        f"{name}: {c['calls']} calls, {c['reads']} reads, {c['writes']} writes, {c['bytes']} B"
+        for name, c in io_stats.snapshot().items()
+    ]
+    return "💾 Store I/O per handler\n\n" + ("\n".join(lines) or "No traffic yet.")
+
 # --- Admin Panel command (shows inline menu) ---
 async def power_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
@@ -465,7 +749,7 @@ async def power_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
     ])
     await update.message.reply_text("🧠 Admin Control Panel", reply_markup=kb)
-    log_admin_action(f"ADMIN_OPEN: admin_id={update.effective_user.id}")
+    log_admin_action("ADMIN_OPEN", update.effective_user.id)
 
 # --- Handle admin inline button clicks ---
 async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -483,18 +767,8 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
 
     # Stats
     if code == "admin_stats":
-        users = load_users()
-        total_users = len(users)
-        total_balance = sum([float(u.get("balance", 0) or 0) for u in users.values()])
-        total_joined = sum(1 for u in users.values() if u.get("joined_groups"))
-        msg = (
-            f"📊 Stats\n\n"
-            f"Total users: {total_users}\n"
-            f"Users joined both groups: {total_joined}\n"
-            f"Total balance (all users): ₹{round(total_balance,2)}\n"
-        )
-        await query.message.reply_text(msg)
-        log_admin_action(f"ADMIN_STATS viewed by {user_id}")
+        await query.message.reply_text(await stats_text())
+        log_admin_action("ADMIN_STATS", user_id)
         return
 
     # Users (help text)
@@ -507,37 +781,45 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
             "/reset_bonus <user_id> — reset last bonus timer\n            "
         )
         await query.message.reply_text(msg)
-        log_admin_action(f"ADMIN_USERS menu opened by {user_id}")
+        log_admin_action("ADMIN_USERS", user_id)
         return
 
     # Find help
     if code == "admin_find":
         await query.message.reply_text("🔍 Usage: /find <user_id_or_username>\nExample: /find 123456789 or /find looteverything")
-        log_admin_action(f"ADMIN_FIND help shown to {user_id}")
+        log_admin_action("ADMIN_FIND", user_id)
         return
 
     # Broadcast help
     if code == "admin_broadcast":
-        await query.message.reply_text("📢 Usage: /broadcast <message>\nThis will send the message to ALL users in users.json (be careful).")
-        log_admin_action(f"ADMIN_BROADCAST help shown to {user_id}")
+        text = (
+            "📢 Usage: /broadcast <message>\nThis will send the message to ALL users in the user store (be careful).\n"
+            "/broadcast_status [job_id] — progress of a broadcast\n"
+            "/broadcast_cancel <job_id> — stop a running broadcast"
+        )
+        job = await asyncio.to_thread(broadcaster.get)
+        if job:
+            text += "\n\nLast job:\n" + broadcaster.describe(job)
+        await query.message.reply_text(text)
+        log_admin_action("ADMIN_BROADCAST", user_id)
         return
 
     # Config help
     if code == "admin_config":
         await query.message.reply_text(
             "⚙️ Config commands:\n"
-            "/export_db — download users.json\n"
-            "/logs — see recent admin actions\n"
+            "/export_db [csv] [zst] [since] — download user records (gzip JSON Lines; since = ISO date for changes only)\n"
+            "/logs [n] [action=...] [admin=<id>] [user=<id>] — see recent admin actions\n"
             "/reset_bonus <user_id> — clears last_bonus so user can claim\n"
         )
-        log_admin_action(f"ADMIN_CONFIG opened by {user_id}")
+        log_admin_action("ADMIN_CONFIG", user_id)
         return
 
     # Export DB
     if code == "admin_export":
         try:
-            await query.message.reply_document(document=open(USER_FILE, "rb"))
-            log_admin_action(f"ADMIN_EXPORTDB by {user_id}")
+            await send_export(query.message)
+            log_admin_action("ADMIN_EXPORTDB", user_id)
         except Exception as e:
             await query.message.reply_text(f"Failed to send DB: {e}")
             logger.error(f"ADMIN_EXPORT error: {e}")
@@ -546,14 +828,8 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
     # Logs
     if code == "admin_logs":
         try:
-            if os.path.exists(ADMIN_LOG_FILE):
-                with open(ADMIN_LOG_FILE, "r", encoding="utf-8") as f:
-                    lines = f.read().strip().splitlines()[-50:]
-                    text = "🧾 Recent admin actions:\n\n" + "\n".join(lines[::-1])
-                    await query.message.reply_text(text or "No logs yet.")
-            else:
-                await query.message.reply_text("No admin logs found.")
-            log_admin_action(f"ADMIN_LOGS viewed by {user_id}")
+            await query.message.reply_text(await recent_admin_actions())
+            log_admin_action("ADMIN_LOGS", user_id)
         except Exception as e:
             await query.message.reply_text(f"Could not read logs: {e}")
             logger.error(f"ADMIN_LOGS error: {e}")
@@ -566,7 +842,7 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
         except:
             pass
         await query.message.reply_text("Admin panel closed.")
-        log_admin_action(f"ADMIN_CLOSE by {user_id}")
+        log_admin_action("ADMIN_CLOSE", user_id)
         return
 
 # --- Admin command implementations ---
@@ -575,47 +851,36 @@ async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
         await update.message.reply_text("❌ Not authorized.")
         return
-    users = load_users()
-    total_users = len(users)
-    total_balance = sum([float(u.get("balance", 0) or 0) for u in users.values()])
-    total_joined = sum(1 for u in users.values() if u.get("joined_groups"))
-    msg = (
-        f"📊 Stats\n\n"
-        f"Total users: {total_users}\n"
-        f"Users joined both groups: {total_joined}\n"
-        f"Total balance (all users): ₹{round(total_balance,2)}\n"
-    )
-    await update.message.reply_text(msg)
-    log_admin_action(f"CMD_stats by {update.effective_user.id}")
+    await update.message.reply_text(await stats_text())
+    log_admin_action("CMD_stats", update.effective_user.id)
 
 async def find_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
         await update.message.reply_text("❌ Not authorized.")
         return
     if not context.args:
-        await update.message.reply_text("Usage: /find <user_id_or_username>")
+        await update.message.reply_text("Usage: /find <user_id_or_username> [page]")
         return
-    key = " ".join(context.args).lstrip("@")
-    users = load_users()
+    words, page = split_page_arg(context.args)
+    key = " ".join(words).lstrip("@")
     # numeric ID
-    if key.isdigit() and key in users:
-        info = users[key]
+    info = await user_store.aget(key) if key.isdigit() else None
+    if info is not None:
         await update.message.reply_text(f"{key} | @{info.get('username','-')} | {info.get('first_name','-')} | bal: ₹{info.get('balance',0)} | joined: {info.get('joined_at','-')}")
-        log_admin_action(f"CMD_find id {key} by {update.effective_user.id}")
+        log_admin_action("CMD_find", update.effective_user.id, target=key)
         return
     # find by username or name substring
-    matches = []
-    for uid, info in users.items():
-        if key.lower() in (info.get("username") or "").lower() or key.lower() in (info.get("first_name") or "").lower():
-            matches.append((uid, info))
+    matches = await asyncio.to_thread(user_store.search, key, ADMIN_PAGE_SIZE, (page - 1) * ADMIN_PAGE_SIZE)
     if not matches:
         await update.message.reply_text("No matches found.")
         return
     lines = []
     for uid, info in matches:
         lines.append(f"{uid} | @{info.get('username','-')} | {info.get('first_name','-')} | bal: ₹{info.get('balance',0)} | joined: {info.get('joined_at','-')}")
+    if len(matches) == ADMIN_PAGE_SIZE:
+        lines.append(f"\nNext page: /find {key} {page + 1}")
     await update.message.reply_text("\n".join(lines))
-    log_admin_action(f"CMD_find key='{key}' by {update.effective_user.id}")
+    log_admin_action("CMD_find", update.effective_user.id, query=key)
 
 async def add_balance_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
@@ -630,13 +895,9 @@ async def add_balance_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         await update.message.reply_text("Amount must be a number.")
         return
-    users = load_users()
-    if uid not in users:
-        users[uid] = {"balance": 0.0, "joined_groups": False}
-    users[uid]["balance"] = users[uid].get("balance", 0) + amt
-    save_users(users)
-    await update.message.reply_text(f"✅ Added ₹{amt} to {uid}. New balance: ₹{users[uid]['balance']}")
-    log_admin_action(f"CMD_add_balance {amt} to {uid} by {update.effective_user.id}")
+    balance = await user_store.acredit(uid, amt, ledger.ADMIN_ADD)
+    await update.message.reply_text(f"✅ Added ₹{amt} to {uid}. New balance: ₹{balance}")
+    log_admin_action("CMD_add_balance", update.effective_user.id, target=uid, amount=amt)
 
 async def deduct_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
@@ -651,18 +912,16 @@ async def deduct_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         await update.message.reply_text("Amount must be a number.")
         return
-    users = load_users()
-    if uid not in users:
+    balance = await user_store.adebit(uid, amt, ledger.ADMIN_DEDUCT)
+    if balance is None:
         await update.message.reply_text("User not found.")
         return
-    users[uid]["balance"] = users[uid].get("balance", 0) - amt
-    save_users(users)
     try:
         await context.bot.send_message(chat_id=int(uid), text=f"⚠️ Your account has been adjusted by ₹{amt}. Please contact admin if you think this is wrong.")
     except Exception:
         pass
-    await update.message.reply_text(f"✅ Deducted ₹{amt} from {uid}. New balance: ₹{users[uid]['balance']}")
-    log_admin_action(f"CMD_deduct {amt} from {uid} by {update.effective_user.id}")
+    await update.message.reply_text(f"✅ Deducted ₹{amt} from {uid}. New balance: ₹{balance}")
+    log_admin_action("CMD_deduct", update.effective_user.id, target=uid, amount=amt)
 
 async def reset_bonus_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
@@ -672,14 +931,11 @@ async def reset_bonus_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /reset_bonus <user_id>")
         return
     uid = context.args[0]
-    users = load_users()
-    if uid not in users:
+    if not await user_store.aupdate(uid, last_bonus=None):
         await update.message.reply_text("User not found.")
         return
-    users[uid].pop("last_bonus", None)
-    save_users(users)
     await update.message.reply_text(f"✅ Reset last_bonus for {uid}. They can claim again immediately.")
-    log_admin_action(f"CMD_reset_bonus for {uid} by {update.effective_user.id}")
+    log_admin_action("CMD_reset_bonus", update.effective_user.id, target=uid)
 
 async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
@@ -689,27 +945,43 @@ async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /broadcast <message>")
         return
     msg = " ".join(context.args)
-    users = load_users()
-    sent = 0
-    failed = 0
-    await update.message.reply_text("📢 Broadcast started. This may take a while.")
-    for uid in list(users.keys()):
-        try:
-            await context.bot.send_message(chat_id=int(uid), text=msg)
-            sent += 1
-            await asyncio.sleep(0.05)  # small delay to reduce flood risk
-        except Exception:
-            failed += 1
-    await update.message.reply_text(f"📤 Broadcast finished. Sent: {sent}, Failed: {failed}")
-    log_admin_action(f"CMD_broadcast by {update.effective_user.id} sent={sent} failed={failed}")
+    # Runs in the background; progress is reported to this chat
+    job_id = await broadcaster.create(msg, update.effective_chat.id)
+    await update.message.reply_text(f"📢 Broadcast #{job_id} started. Check /broadcast_status {job_id}")
+    log_admin_action("CMD_broadcast", update.effective_user.id, job=job_id)
+
+async def broadcast_status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Not authorized.")
+        return
+    job_id = int(context.args[0]) if context.args and context.args[0].isdigit() else None
+    job = await asyncio.to_thread(broadcaster.get, job_id)
+    if not job:
+        await update.message.reply_text("No broadcast found.")
+        return
+    await update.message.reply_text(broadcaster.describe(job))
+
+async def broadcast_cancel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Not authorized.")
+        return
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /broadcast_cancel <job_id>")
+        return
+    job_id = int(context.args[0])
+    if not await broadcaster.cancel(job_id):
+        await update.message.reply_text(f"Broadcast #{job_id} is not running.")
+        return
+    await update.message.reply_text(f"🛑 Broadcast #{job_id} cancelled.")
+    log_admin_action("CMD_broadcast_cancel", update.effective_user.id, job=job_id)
 
 async def export_db_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
         await update.message.reply_text("❌ Not authorized.")
         return
     try:
-        await update.message.reply_document(document=open(USER_FILE, "rb"))
-        log_admin_action(f"CMD_export_db by {update.effective_user.id}")
+        await send_export(update.message, context.args or ())
+        log_admin_action("CMD_export_db", update.effective_user.id)
     except Exception as e:
         await update.message.reply_text(f"Failed to send DB: {e}")
         logger.error(f"CMD_export_db error: {e}")
@@ -718,40 +990,251 @@ async def logs_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
         await update.message.reply_text("❌ Not authorized.")
         return
-    if not os.path.exists(ADMIN_LOG_FILE):
-        await update.message.reply_text("No admin logs found.")
+    # /logs [n] [action=CMD_deduct] [admin=<id>] [user=<id>]
+    n = ADMIN_LOG_TAIL
+    criteria = {}
+    for arg in context.args or []:
+        key, _, value = arg.partition("=")
+        if arg.isdigit():
+            n = min(int(arg), 200)
+        elif key == "action" and value:
+            criteria["action"] = value
+        elif key == "admin" and value.isdigit():
+            criteria["admin_id"] = int(value)
+        elif key == "user" and value:
+            criteria["target"] = value
+    await update.message.reply_text(await recent_admin_actions(n, **criteria))
+
+async def iostats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Not authorized.")
         return
-    with open(ADMIN_LOG_FILE, "r", encoding="utf-8") as f:
-        lines = f.read().splitlines()[-50:]
-    await update.message.reply_text("🧾 Recent admin actions:\n\n" + "\n".join(lines[::-1]))
+    await update.message.reply_text(iostats_text())
+
+# Sampling profiler: idle unless PROFILE_SAMPLER=1 (runs from startup) or an admin sends /profile
+profiler = StackSampler(interval=float(os.getenv("PROFILE_INTERVAL", "0.005")))
+PROFILE_ALWAYS = os.getenv("PROFILE_SAMPLER") == "1"
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 120
+profile_tasks = set()
+
+def hot_stacks_text(n=10, frames=3):
+    """The n hottest stacks, each trimmed to its innermost frames."""
+    if not profiler.samples:
+        return "No samples yet."
+    lines = [f"🔬 Hot stacks ({profiler.samples} samples, {profiler.idle} idle thread samples)\n"]
+    hot = Counter()
+    for stack, count in profiler.top(None):
+        hot[" ← ".join(reversed(stack.split(";")[-frames:]))] += count
+    for inner, count in hot.most_common(n):
+        lines.append(f"{count * 100 / profiler.samples:.1f}%  {inner}")
+    return "\n".join(lines)[:4000]
+
+async def send_profile(message, seconds):
+    if seconds:
+        await profiler.sample_for(seconds)
+    await message.reply_text(hot_stacks_text())
+    if profiler.samples:
+        name = f"stacks-{datetime.utcnow():%Y%m%dT%H%M%S}.txt"
+        await message.reply_document(document=profiler.collapsed().encode(), filename=name)
+
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Not authorized.")
+        return
+    # /profile [seconds] — with PROFILE_SAMPLER=1 it dumps what has been sampled since startup
+    seconds = 0
+    if not profiler.running:
+        seconds = PROFILE_DEFAULT_SECONDS
+        if context.args and context.args[0].isdigit():
+            seconds = min(max(int(context.args[0]), 1), PROFILE_MAX_SECONDS)
+        await update.message.reply_text(f"🔬 Sampling stacks for {seconds}s...")
+    # In the background, so this user's later updates aren't held behind the sampling
+    task = asyncio.create_task(send_profile(update.message, seconds))
+    profile_tasks.add(task)
+    task.add_done_callback(profile_tasks.discard)
+    log_admin_action("CMD_profile", update.effective_user.id, seconds=seconds)
 
 # --- Register admin handlers (attach these to tg_app) ---
-tg_app.add_handler(CommandHandler("power", power_command))
-tg_app.add_handler(CallbackQueryHandler(handle_admin_callback, pattern="^admin_"))
-tg_app.add_handler(CommandHandler("stats", stats_cmd))
-tg_app.add_handler(CommandHandler("find", find_cmd))
-tg_app.add_handler(CommandHandler("add_balance", add_balance_cmd))
-tg_app.add_handler(CommandHandler("deduct", deduct_cmd))
-tg_app.add_handler(CommandHandler("reset_bonus", reset_bonus_cmd))
-tg_app.add_handler(CommandHandler("broadcast", broadcast_cmd))
-tg_app.add_handler(CommandHandler("export_db", export_db_cmd))
-tg_app.add_handler(CommandHandler("logs", logs_cmd))
+add_handler(CommandHandler("power", power_command))
+add_handler(CallbackQueryHandler(handle_admin_callback, pattern="^admin_"))
+add_handler(CommandHandler("stats", stats_cmd))
+add_handler(CommandHandler("find", find_cmd))
+add_handler(CommandHandler("add_balance", add_balance_cmd))
+add_handler(CommandHandler("deduct", deduct_cmd))
+add_handler(CommandHandler("reset_bonus", reset_bonus_cmd))
+add_handler(CommandHandler("broadcast", broadcast_cmd))
+add_handler(CommandHandler("broadcast_status", broadcast_status_cmd))
+add_handler(CommandHandler("broadcast_cancel", broadcast_cancel_cmd))
+add_handler(CommandHandler("export_db", export_db_cmd))
+add_handler(CommandHandler("logs", logs_cmd))
+add_handler(CommandHandler("iostats", iostats_cmd))
+add_handler(CommandHandler("profile", profile_cmd))
 
 # Optional: also register /power alias to open panel
-tg_app.add_handler(CommandHandler("admin", power_command))
+add_handler(CommandHandler("admin", power_command))
+
+def build_tg_app():
+    """Create the Application and register HANDLERS (sync; run it off the event loop).
+
+    Returns (application, its HTTP request objects).
+    """
+    requests = (InstrumentedRequest(connection_pool_size=256), HTTPXRequest())
+    application = (
+        Application.builder().token(BOT_TOKEN).base_url(TELEGRAM_API_URL)
+        .request(requests[0])
+        .get_updates_request(requests[1])
+        .concurrent_updates(PerUserProcessor(UPDATE_CONCURRENCY))
+        .build()
+    )
+    for handler, group in HANDLERS:
+        application.add_handler(handler, group)
+    return application, requests
+
+tg_ready = None  # Task building + initializing tg_app; see ready_tg_app()
+
+async def init_tg_app():
+    global tg_app
+    started = time.perf_counter()
+    application, requests = await asyncio.to_thread(build_tg_app)
+    try:
+        await application.initialize()  # getMe, once per process
+        await application.start()
+    except BaseException:
+        # The bot only counts as initialized once getMe succeeds, so application.shutdown()
+        # would skip the clients here; close them directly, the retry builds new ones
+        await asyncio.gather(*(request.shutdown() for request in requests))
+        raise
+    tg_app = application
+    await outbox.start(tg_app.bot)
+    await broadcaster.start(tg_app.bot)
+    logger.info(f"🤖 Telegram app ready in {time.perf_counter() - started:.2f}s")
+    return tg_app
+
+async def ready_tg_app():
+    """Return tg_app, started; the first caller starts it and the rest wait for that one run."""
+    global tg_ready
+    if tg_ready is None or (tg_ready.done() and not tg_ready.cancelled() and tg_ready.exception()):
+        tg_ready = asyncio.create_task(init_tg_app())  # first call, or retry after a failed start
+    if not tg_ready.done():
+        # shielded: a cancelled caller (shutdown, dropped request) mustn't cancel the shared start
+        await asyncio.shield(tg_ready)
+    return tg_ready.result()
+
+# Safe to leave on: set_webhook() does nothing when Telegram already has our URL
+SET_WEBHOOK_ON_START = os.getenv("SET_WEBHOOK", "1") == "1"
+STATS_RECONCILE_SECONDS = float(os.getenv("STATS_RECONCILE_SECONDS", "3600"))
+background_tasks = []
+leader_tasks = []  # only run while this worker holds the leader lease
+
+async def on_leadership(held):
+    if held:
+        leader_tasks.append(asyncio.create_task(user_store.stats.run_reconciler(STATS_RECONCILE_SECONDS)))
+        if BONUS_REMINDERS:
+            leader_tasks.append(asyncio.create_task(bonus_reminders.run()))
+        if MEMBER_SWEEP:
+            leader_tasks.append(asyncio.create_task(membership_sweeper.run(tg_app.bot, punished_by_sweep)))
+        await broadcaster.resume()
+        if SET_WEBHOOK_ON_START:
+            await set_webhook()
+        return
+    for task in leader_tasks:
+        task.cancel()
+    leader_tasks.clear()
+    await broadcaster.suspend()
+
+async def leader_tick():
+    # pick up broadcasts queued by /broadcast on other workers
+    await broadcaster.resume()
+
+WARM_UP_MAX_BACKOFF = 60  # seconds between startup retries, at most
+
+async def warm_up():
+    # Bot-side startup, in the background so the server answers while it runs.
+    # Retried until it works: the lease, webhook and leader jobs all wait on it.
+    delay = 1
+    while True:
+        try:
+            await ready_tg_app()
+            break
+        except Exception as e:
+            logger.error(f"⚠️ Telegram app startup failed, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARM_UP_MAX_BACKOFF)
+    # The lease loop takes the lease right away and keeps retrying if the store is busy
+    background_tasks.append(asyncio.create_task(leader.run(on_leadership, leader_tick)))
+
+@app.before_serving
+async def start_bot():
+    # Runs once per worker process, on the same event loop that serves every route.
+    # Nothing here waits on the network: tg_app warms up in the background.
+    if PROFILE_ALWAYS:
+        profiler.start()
+    background_tasks.append(asyncio.create_task(warm_up()))
+    background_tasks.append(asyncio.create_task(ad_inventory.run_flusher(AD_COUNTER_FLUSH_SECONDS)))
+    remote_videos = lambda: [ad["video_url"] for ad in ad_inventory.ads() if ad.get("video_url")]
+    background_tasks.append(asyncio.create_task(media.run_health_checks(remote_videos, MEDIA_CHECK_SECONDS)))
+
+@app.after_serving
+async def stop_bot():
+    global tg_app, tg_ready
+    if tg_ready is not None and not tg_ready.done():
+        tg_ready.cancel()
+    for task in background_tasks + leader_tasks:
+        task.cancel()
+    background_tasks.clear()
+    leader_tasks.clear()
+    if leader.held:
+        await asyncio.to_thread(leader.release)
+    await asyncio.to_thread(ad_inventory.flush)
+    await asyncio.to_thread(admin_log.flush)
+    await asyncio.to_thread(profiler.stop)
+    await broadcaster.stop()
+    await outbox.stop()
+    if tg_app is not None:
+        await tg_app.stop()
+        await tg_app.shutdown()
+    tg_app = tg_ready = None  # a restarted app (tests, bench) builds a fresh one
 
 @app.route(f"/{BOT_TOKEN}", methods=["POST"])
 async def webhook():
-    data = request.get_json(force=True)
-    update = Update.de_json(data, tg_app.bot)
-    if not tg_app._initialized:
-        await tg_app.initialize()
-    await tg_app.process_update(update)
+    # Hand the update to tg_app's queue and answer Telegram right away;
+    # handlers run in the background on the shared loop.
+    # The first update after a cold start waits here if tg_app is still warming up.
+    data = await request.get_json(force=True)
+    update_id = data.get("update_id")
+    if await update_dedup.seen(update_id):
+        logger.info(f"🔁 Dropped redelivered update {update_id}")
+        return "OK", 200
+    try:
+        application = tg_app or await ready_tg_app()
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    except BaseException:
+        # Not queued: Telegram redelivers after the error, and that copy must get through
+        await update_dedup.forget(update_id)
+        raise
     return "OK", 200
 
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")  # if set, /metrics needs "Authorization: Bearer <token>"
+# Each worker reports its own series (labelled worker="<pid>"); sum over worker when querying
+
+@app.route("/metrics")
+async def metrics_page():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return "Unauthorized", 401
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+# Time every route (see /metrics); stays below the last @app.route so none are missed
+for _endpoint, _view in list(app.view_functions.items()):
+    app.view_functions[_endpoint] = metrics.track(app.ensure_async(_view), "route", _endpoint)
+
 async def set_webhook():
     url = f"{DOMAIN}/{BOT_TOKEN}"
     try:
+        # Every cold start would otherwise re-register (and Telegram rate-limits setWebhook)
+        if (await tg_app.bot.get_webhook_info()).url == url:
+            logger.info(f"✅ Webhook already set to {url}")
+            return
         await tg_app.bot.set_webhook(url)
         logger.info(f"✅ Webhook set to {url}")
     except Exception as e:
@@ -761,9 +1244,7 @@ async def set_webhook():
 # 🚀 Start App
 # ------------------------
 def main():
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(set_webhook())
-    # Start flask app (this will block)
+    # Start the web app (this will block)
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", "10000")))
 
 if __name__ == "__main__":
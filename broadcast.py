@@ -0,0 +1,205 @@
+# broadcast.py — Rate-limited, resumable broadcast jobs
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from telegram.error import Forbidden, RetryAfter
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    text       TEXT NOT NULL,
+    admin_chat INTEGER NOT NULL,
+    status     TEXT NOT NULL,
+    cursor     TEXT NOT NULL DEFAULT '',
+    total      INTEGER NOT NULL DEFAULT 0,
+    sent       INTEGER NOT NULL DEFAULT 0,
+    failed     INTEGER NOT NULL DEFAULT 0,
+    blocked    INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+
+class BroadcastEngine:
+    """Runs broadcast jobs in the background on tg_app's loop.
+
+    Sends are spread over `concurrency` tasks but all pass through one token
+    bucket tuned below Telegram's ~30 msg/s global limit (each chat gets one
+    message per job, so the 1 msg/s per-chat limit holds; progress edits to
+    the admin chat are throttled to one per `progress_every` seconds).
+    Users are walked in user_id order and the cursor is saved after every
+    page, so a job interrupted by a restart resumes where it stopped.
+
+    Jobs only run in the process that called resume() (the leader worker,
+    see lease.py); other workers just insert the job row and the leader
+    picks it up on its next resume(). Cancelling flips the row's status,
+    which the running job checks before every page.
+    """
+
+    def __init__(self, store, rate=25, concurrency=10, page_size=50, progress_every=5.0):
+        self.store = store
+        self.limiter = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.progress_every = progress_every
+        self.bot = None
+        self.active = False
+        self._tasks = {}
+        self.store.connect().executescript(SCHEMA)
+
+    async def start(self, bot):
+        """Attach the bot. Jobs run once resume() is called."""
+        self.bot = bot
+
+    async def resume(self):
+        """Run every job marked running that isn't running here yet (new or left by another process)."""
+        self.active = True
+        for job_id in await asyncio.to_thread(self._running_ids):
+            if job_id not in self._tasks:
+                logger.info(f"Resuming broadcast #{job_id}")
+                self._spawn(job_id)
+
+    async def suspend(self):
+        """Stop running jobs here; they stay 'running' in the DB for the next resume()."""
+        self.active = False
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks = {}
+
+    async def stop(self):
+        await self.suspend()
+
+    async def create(self, text, admin_chat):
+        """Create and start a broadcast job. Returns the job id."""
+        now = datetime.utcnow().isoformat()
+
+        def write(db):
+            # Runs on the ledger writer thread, off the event loop
+            total = db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            return db.execute(
+                "INSERT INTO broadcast_jobs (text, admin_chat, status, total, created_at, updated_at) "
+                "VALUES (?, ?, 'running', ?, ?, ?)",
+                (text, admin_chat, total, now, now),
+            ).lastrowid
+        job_id = await asyncio.wrap_future(self.store.ledger.submit(write))
+        if self.active:
+            self._spawn(job_id)
+        return job_id
+
+    async def cancel(self, job_id):
+        """Stop a running job, wherever it runs. Returns False if no such job is running."""
+        job = await asyncio.to_thread(self.get, job_id)
+        if job is None or job["status"] != "running":
+            return False
+        self._update(job_id, status="cancelled")
+        task = self._tasks.pop(job_id, None)
+        if task is not None:
+            task.cancel()
+        return True
+
+    def _running_ids(self):
+        rows = self.store.connect().execute("SELECT id FROM broadcast_jobs WHERE status = 'running'")
+        return [job_id for (job_id,) in rows]
+
+    def get(self, job_id=None):
+        """Return a job as a dict (the latest one if job_id is None), or None."""
+        db = self.store.connect()
+        if job_id is None:
+            row = db.execute("SELECT * FROM broadcast_jobs ORDER BY id DESC LIMIT 1").fetchone()
+        else:
+            row = db.execute("SELECT * FROM broadcast_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    @staticmethod
+    def describe(job, rate=None):
+        done = job["sent"] + job["failed"] + job["blocked"]
+        text = (
+            f"📢 Broadcast #{job['id']} — {job['status']}\n"
+            f"Progress: {done}/{job['total']}\n"
+            f"Sent: {job['sent']}, Failed: {job['failed']}, Blocked bot: {job['blocked']}"
+        )
+        if rate is not None:
+            text += f"\nThroughput: {rate:.1f} msg/s"
+        return text
+
+    def _spawn(self, job_id):
+        self._tasks[job_id] = asyncio.create_task(self._run(job_id), name=f"broadcast-{job_id}")
+
+    def _update(self, job_id, **fields):
+        # Write-behind: queued on the store's writer thread, which keeps the order
+        fields["updated_at"] = datetime.utcnow().isoformat()
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        return self.store.ledger.submit(
+            lambda db: db.execute(f"UPDATE broadcast_jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+        )
+
+    async def _send(self, chat_id, text):
+        for _ in range(3):
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=int(chat_id), text=text)
+                return "sent"
+            except RetryAfter as e:
+                self.limiter.pause(e.retry_after)
+            except Forbidden:
+                return "blocked"
+            except Exception as e:
+                logger.warning(f"Broadcast send to {chat_id} failed: {e}")
+                return "failed"
+        return "failed"
+
+    async def _report(self, job, rate, message_id=None):
+        text = self.describe(job, rate)
+        try:
+            if message_id is None:
+                return (await self.bot.send_message(chat_id=job["admin_chat"], text=text)).message_id
+            await self.bot.edit_message_text(chat_id=job["admin_chat"], message_id=message_id, text=text)
+        except Exception as e:
+            logger.warning(f"Could not report broadcast #{job['id']} progress: {e}")
+        return message_id
+
+    async def _run(self, job_id):
+        job = await asyncio.to_thread(self.get, job_id)
+        slots = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        sent_here = 0
+        last_report = started
+        message_id = await self._report(job, None)
+
+        async def send(chat_id):
+            async with slots:
+                return await self._send(chat_id, job["text"])
+
+        while True:
+            current = await asyncio.to_thread(self.get, job_id)
+            if current is None or current["status"] != "running":
+                # cancelled, possibly from another worker
+                self._tasks.pop(job_id, None)
+                return
+            ids = await asyncio.to_thread(self.store.page_ids, job["cursor"], self.page_size)
+            if not ids:
+                break
+            results = await asyncio.gather(*(send(uid) for uid in ids))
+            for result in results:
+                job[result] += 1
+            sent_here += len(results)
+            job["cursor"] = ids[-1]
+            self._update(job_id, cursor=job["cursor"], sent=job["sent"], failed=job["failed"], blocked=job["blocked"])
+
+            if time.monotonic() - last_report >= self.progress_every:
+                last_report = time.monotonic()
+                await self._report(job, sent_here / (last_report - started), message_id)
+
+        job["status"] = "done"
+        self._update(job_id, status="done")
+        self._tasks.pop(job_id, None)
+        await self._report(job, sent_here / max(time.monotonic() - started, 1e-6), message_id)
+        logger.info(f"Broadcast #{job_id} finished: sent={job['sent']} failed={job['failed']} blocked={job['blocked']}")
@@ -0,0 +1,136 @@
+# dispatch.py — Update ingest: update_id dedup and per-user ordered concurrent processing
+import asyncio
+import logging
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_updates (
+    update_id INTEGER PRIMARY KEY
+);
+"""
+
+
+class UpdateDedup:
+    """Remembers the last `window` update_ids so redelivered updates are dropped.
+
+    Telegram redelivers an update whenever the webhook answers slowly or
+    not at all. The recent ids live in a bounded ring (deque + set) in
+    process memory. With a store, ids are also claimed in its database so
+    a redelivery that lands on another worker process is caught too.
+    """
+
+    def __init__(self, window=10000, store=None, purge_every=1000):
+        self.window = window
+        self.store = store
+        self.purge_every = purge_every
+        self.duplicates = 0
+        self._order = deque()
+        self._ids = set()
+        self._claims = 0
+        if store is not None:
+            store.connect().executescript(SCHEMA)
+
+    def _remember(self, update_id):
+        self._ids.add(update_id)
+        self._order.append(update_id)
+        if len(self._order) > self.window:
+            self._ids.discard(self._order.popleft())
+
+    def _claim(self, update_id):
+        db = self.store.connect()
+        claimed = db.execute("INSERT OR IGNORE INTO seen_updates (update_id) VALUES (?)", (update_id,)).rowcount == 1
+        self._claims += 1
+        if self._claims % self.purge_every == 0:
+            # update_ids increase, so anything a full window behind the newest can go
+            db.execute("DELETE FROM seen_updates WHERE update_id < ?", (update_id - self.window,))
+        return claimed
+
+    def _unclaim(self, update_id):
+        self.store.connect().execute("DELETE FROM seen_updates WHERE update_id = ?", (update_id,))
+
+    async def seen(self, update_id):
+        """Record update_id; True if it was already seen (drop the update)."""
+        if update_id is None:
+            return False
+        if update_id in self._ids:
+            self.duplicates += 1
+            return True
+        # Remembered before the await, so a copy arriving meanwhile is caught in memory
+        self._remember(update_id)
+        if self.store is not None and not await asyncio.to_thread(self._claim, update_id):
+            self.duplicates += 1
+            return True
+        return False
+
+    async def forget(self, update_id):
+        """Undo seen() for an update that was not queued, so Telegram's redelivery is accepted."""
+        if update_id is None or update_id not in self._ids:
+            return
+        self._ids.discard(update_id)
+        self._order.remove(update_id)  # only on failures, so the O(window) scan is fine
+        if self.store is not None:
+            await asyncio.to_thread(self._unclaim, update_id)
+
+
+class PerUserProcessor(BaseUpdateProcessor):
+    """Runs updates from different users concurrently, each user's strictly in order.
+
+    Every update first queues on its user's lock (asyncio locks are FIFO,
+    and the Application starts update tasks in arrival order), and only
+    then takes one of `limit` slots. A user sending a burst therefore
+    waits behind their own earlier updates without holding slots other
+    users need. Locks are dropped once a user has nothing queued, so
+    memory follows the number of active users. The base class's own
+    semaphore is sized so it never waits; the limit is enforced here.
+
+    Ordering holds within one process. With WEB_CONCURRENCY>1 a user's
+    updates can reach different workers, which do not wait for each other.
+    """
+
+    UNBOUNDED = 1 << 30  # for the base class, so every update reaches do_process_update
+
+    def __init__(self, limit):
+        super().__init__(self.UNBOUNDED)
+        self.limit = limit
+        self._slots = asyncio.BoundedSemaphore(limit)
+        self._chains = {}  # user or chat id -> [lock, updates queued or running]
+
+    @staticmethod
+    def _key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        chain = self._chains.get(key)
+        if chain is None:
+            chain = self._chains[key] = [asyncio.Lock(), 0]
+        chain[1] += 1
+        try:
+            async with chain[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            chain[1] -= 1
+            if not chain[1]:
+                del self._chains[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
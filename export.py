@@ -0,0 +1,128 @@
+# export.py — Streaming, compressed snapshot export of the user store
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:  # optional: pip install zstandard for .zst exports
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ("user_id", "balance", "joined_groups", "first_name", "username", "joined_at", "last_bonus", "updated_at")
+FORMATS = ("jsonl", "csv")
+COMPRESSIONS = ("gz", "zst")
+
+# Bots may upload documents up to 50 MB; leave headroom for the compressor's buffered tail
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024
+PART_LIMIT = TELEGRAM_DOCUMENT_LIMIT - 2 * 1024 * 1024
+
+
+class _CountingFile(io.RawIOBase):
+    """Write-only file wrapper that counts the (compressed) bytes that reach disk."""
+
+    def __init__(self, f):
+        self.f = f
+        self.written = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        n = self.f.write(b)
+        self.written += n
+        return n
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        super().close()
+        self.f.close()
+
+
+class _Part:
+    def __init__(self, path, fmt, compression):
+        self.path = path
+        self.raw = _CountingFile(open(path, "wb"))
+        if compression == "zst":
+            self.compressed = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        else:
+            self.compressed = gzip.GzipFile(fileobj=self.raw, mode="wb")
+        self.text = io.TextIOWrapper(self.compressed, encoding="utf-8", newline="")
+        self.csv = None
+        if fmt == "csv":
+            self.csv = csv.writer(self.text)
+            self.csv.writerow(EXPORT_COLUMNS)
+
+    def write(self, row):
+        if self.csv is not None:
+            self.csv.writerow(row)
+        else:
+            self.text.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.text.close()
+        self.raw.close()
+
+
+def export_users(db_path, out_dir, fmt="jsonl", compression="gz", since=None, part_limit=PART_LIMIT, chunk_size=1000):
+    """Write a point-in-time snapshot of the users table to compressed part files.
+
+    Rows are streamed `chunk_size` at a time from a single SELECT (one
+    consistent WAL snapshot, unaffected by concurrent writers) and a new
+    part is started whenever the compressed size reaches `part_limit`.
+    With `since` (ISO timestamp) only users changed at or after it are
+    exported. Returns the list of part file paths.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown export compression: {compression}")
+    if compression == "zst" and zstandard is None:
+        raise ValueError("zstd export needs the zstandard package")
+
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    kind = "changes" if since else "users"
+    db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        sql = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM users"
+        params = ()
+        if since:
+            sql += " WHERE updated_at >= ?"
+            params = (since,)
+        cur = db.execute(sql + " ORDER BY user_id", params)
+
+        paths = []
+        part = None
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                if part is None:
+                    path = os.path.join(out_dir, f"{kind}-{stamp}-part{len(paths) + 1}.{fmt}.{compression}")
+                    part = _Part(path, fmt, compression)
+                    paths.append(path)
+                part.write(row)
+            part.text.flush()
+            if part.raw.written >= part_limit:
+                part.close()
+                part = None
+        if part is not None:
+            part.close()
+        if not paths:
+            # Always hand back a file, even for an empty incremental export
+            path = os.path.join(out_dir, f"{kind}-{stamp}-part1.{fmt}.{compression}")
+            _Part(path, fmt, compression).close()
+            paths.append(path)
+    finally:
+        db.close()
+    logger.info(f"Exported {kind} to {len(paths)} part(s)")
+    return paths
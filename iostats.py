@@ -0,0 +1,59 @@
+# iostats.py — Per-handler counters of user store reads, writes and bytes written
+import contextvars
+import functools
+import json
+import threading
+
+_current = contextvars.ContextVar("iostats_handler", default="other")
+
+
+class IOStats:
+    """Counts store traffic per handler.
+
+    Handlers wrapped with track() tag their context with their name; the
+    store calls read()/write() and the counts land under whichever handler
+    is running. Bytes are the JSON size of the values written, a stable
+    proxy for the row payload rather than exact on-disk pages.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}  # handler -> [calls, reads, writes, bytes]
+
+    def _bump(self, handler, index, n=1):
+        with self._lock:
+            counts = self._counts.setdefault(handler, [0, 0, 0, 0])
+            counts[index] += n
+
+    def read(self):
+        self._bump(_current.get(), 1)
+
+    def write(self, values):
+        handler = _current.get()
+        self._bump(handler, 2)
+        self._bump(handler, 3, len(json.dumps(values, default=str)))
+
+    def track(self, func, name=None):
+        """Wrap an async handler so store traffic inside it is counted under its name."""
+        name = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = _current.set(name)
+            self._bump(name, 0)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _current.reset(token)
+        return wrapper
+
+    def snapshot(self):
+        """Return {handler: {"calls", "reads", "writes", "bytes"}}."""
+        with self._lock:
+            return {
+                name: dict(zip(("calls", "reads", "writes", "bytes"), counts))
+                for name, counts in sorted(self._counts.items())
+            }
+
+
+io_stats = IOStats()
@@ -0,0 +1,77 @@
+# lease.py — Expiring named leases so one worker process runs the singleton jobs
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name       TEXT PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class Lease:
+    """A named lease in the shared store, held by at most one process at a time.
+
+    Under gunicorn every worker imports bot.py and runs its own Application;
+    work that must happen once (setting the webhook, broadcasts, periodic
+    reconciliation) is done only by the worker holding the "leader" lease.
+    The holder renews it every `ttl / 3` seconds; if it dies, another worker
+    takes over once the lease expires.
+    """
+
+    def __init__(self, store, name, ttl=30.0):
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.held = False
+        self.store.connect().executescript(SCHEMA)
+
+    def acquire(self):
+        """Take or renew the lease if it is free, expired or already ours. Returns True if held."""
+        now = time.time()
+        with self.store.transaction() as db:
+            db.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                (self.name, self.owner, now + self.ttl, now),
+            )
+            row = db.execute("SELECT owner FROM leases WHERE name = ?", (self.name,)).fetchone()
+        self.held = row is not None and row[0] == self.owner
+        return self.held
+
+    def release(self):
+        with self.store.transaction() as db:
+            db.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (self.name, self.owner))
+        self.held = False
+
+    async def run(self, on_change, tick=None):
+        """Keep trying to take/renew the lease; awaits on_change(held) whenever that flips.
+
+        tick(), if given, is awaited after every renewal while the lease is held.
+        """
+        while True:
+            was_held = self.held
+            try:
+                held = await asyncio.to_thread(self.acquire)
+            except Exception as e:
+                logger.error(f"Lease {self.name} renewal failed: {e}")
+                held = self.held = False
+            if held != was_held:
+                logger.info(f"{'Acquired' if held else 'Lost'} lease {self.name} ({self.owner})")
+                try:
+                    await on_change(held)
+                except Exception as e:
+                    logger.error(f"Lease {self.name} change handler failed: {e}")
+            if held and tick is not None:
+                await tick()
+            await asyncio.sleep(self.ttl / 3)
@@ -0,0 +1,165 @@
+# ledger.py — Append-only balance ledger with group-committed writes
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ledger entry types
+AD_REWARD = "ad_reward"
+BONUS_ONE_GROUP = "bonus_one_group"
+BONUS_BOTH = "bonus_both"
+ADMIN_ADD = "admin_add"
+ADMIN_DEDUCT = "admin_deduct"
+PUNISH = "punish"
+REFERRAL = "referral"
+OPENING_BALANCE = "opening_balance"  # balance carried over by the users.json migration
+
+ENTRY_KINDS = (AD_REWARD, BONUS_ONE_GROUP, BONUS_BOTH, ADMIN_ADD, ADMIN_DEDUCT, PUNISH, REFERRAL, OPENING_BALANCE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ledger (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id    TEXT NOT NULL,
+    kind       TEXT NOT NULL,
+    amount     REAL NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ledger_user ON ledger (user_id, id);
+"""
+
+
+class Entry:
+    """One pending ledger write. amount is signed (debits are negative)."""
+
+    __slots__ = ("user_id", "kind", "amount", "fields", "create", "guard", "future")
+
+    def __init__(self, user_id, kind, amount, fields=None, create=True, guard=None):
+        if kind not in ENTRY_KINDS:
+            raise ValueError(f"Unknown ledger entry kind: {kind}")
+        self.user_id = str(user_id)
+        self.kind = kind
+        self.amount = amount
+        self.fields = fields or {}
+        self.create = create
+        self.guard = guard
+        self.future = Future()
+
+
+class Job:
+    """One pending write that is not a balance change: fn(db) runs in the group transaction."""
+
+    __slots__ = ("fn", "future")
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.future = Future()
+
+
+class Ledger:
+    """Append-only ledger with a materialized balance per user.
+
+    Every credit/debit appends a typed row to the ledger table and updates
+    users.balance in the same transaction. All writes from this process go
+    through one writer thread, which collects queued writes until it has
+    max_batch of them or max_delay seconds have passed since the first, and
+    commits them as a single transaction (group commit). Concurrent posters
+    never race on a read-modify-write, never wait on more than one fsync,
+    and never do the write on the event loop thread. Other store writes
+    join the same groups through submit().
+    """
+
+    def __init__(self, store, max_batch=500, max_delay=0.002):
+        self.store = store
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self.store.connect().executescript(SCHEMA)
+        self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+        self._thread.start()
+
+    def post(self, user_id, kind, amount, fields=None, create=True, guard=None):
+        """Queue a ledger entry and return a Future resolving to the new balance.
+
+        If create is False and the user is unknown, the Future resolves to None
+        and nothing is written. guard, if given, is called as guard(db) inside
+        the commit transaction before the entry is applied; it may write
+        related rows and returns False to skip the entry (resolving to None).
+        """
+        entry = Entry(user_id, kind, amount, fields, create, guard)
+        self._queue.put(entry)
+        return entry.future
+
+    def submit(self, fn):
+        """Queue fn(db) for the writer's next group transaction; returns a Future of its result."""
+        job = Job(fn)
+        self._queue.put(job)
+        return job.future
+
+    def _apply(self, db, entry, now):
+        if entry.guard is not None and not entry.guard(db):
+            return None
+        if entry.create:
+            db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (entry.user_id,))
+        cur = db.execute(
+            "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+            (entry.amount, entry.user_id),
+        )
+        if cur.rowcount == 0:
+            return None
+        self.store.set_fields(db, entry.user_id, entry.fields)
+        db.execute(
+            "INSERT INTO ledger (user_id, kind, amount, created_at) VALUES (?, ?, ?, ?)",
+            (entry.user_id, entry.kind, entry.amount, now),
+        )
+        return db.execute("SELECT balance FROM users WHERE user_id = ?", (entry.user_id,)).fetchone()[0]
+
+    def _commit(self, batch):
+        now = datetime.utcnow().isoformat()
+        with self.store.transaction() as db:
+            return [self._apply(db, item, now) if isinstance(item, Entry) else item.fn(db) for item in batch]
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with metrics.timer("store", "group_commit"):
+                    results = self._commit(batch)
+            except Exception as e:
+                # Retry one by one so a single bad entry doesn't fail the whole group
+                logger.error(f"Ledger group commit of {len(batch)} entries failed: {e}")
+                for entry in batch:
+                    try:
+                        result, error = self._commit([entry])[0], None
+                    except Exception as e:
+                        result, error = None, e
+                    self._resolve(entry.future, result, error)
+                continue
+            for entry, balance in zip(batch, results):
+                self._resolve(entry.future, balance)
+
+    @staticmethod
+    def _resolve(future, result, error=None):
+        # The write is committed either way; a caller that was cancelled
+        # meanwhile (wrap_future cancels this Future) just doesn't hear back
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+        except Exception as e:
+            logger.error(f"Ledger could not deliver a result: {e}")
@@ -0,0 +1,142 @@
+# media.py — Ad video serving from static/ with range requests and CDN fallback
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+
+import httpx
+from quart import Response
+from quart.wrappers.response import FileBody
+from werkzeug.datastructures import ContentRange
+
+logger = logging.getLogger(__name__)
+
+ONE_YEAR = 365 * 24 * 3600
+
+
+class MediaFile:
+    """A local file's metadata plus, for small files, its bytes held in memory."""
+
+    def __init__(self, path, max_cached):
+        st = os.stat(path)
+        self.path = path
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.data = None
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            if self.size <= max_cached:
+                self.data = f.read()
+                digest.update(self.data)
+            else:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        # Strong validator from the content, so byte ranges of it are safe to combine
+        self.etag = digest.hexdigest()[:20]
+
+
+class AdMedia:
+    """Serves ad videos from static/ and picks local file or remote URL per ad.
+
+    Files up to max_cached bytes are read once and served from memory;
+    larger ones stream from disk in large chunks. Either way single byte
+    ranges (including suffix ranges, which Quart's make_conditional
+    mishandles) get a 206/416, multi-range requests the full 200,
+    If-None-Match a 304, and the strong ETag lets the WebView cache the
+    video for a year.
+
+    video_src() prefers `prefer` ("local" or "remote") and falls back to
+    the other source when the preferred one is missing or its last health
+    check failed.
+    """
+
+    def __init__(self, static_dir, prefer="local", max_cached=16 * 1024 * 1024, chunk_size=256 * 1024):
+        self.static_dir = static_dir
+        self.prefer = prefer
+        self.max_cached = max_cached
+        self.chunk_size = chunk_size
+        self._files = {}  # name -> MediaFile
+        self._remote_ok = {}  # url -> last health check result
+
+    def local(self, name):
+        """Return the MediaFile for static/<name>, or None if there is no such file."""
+        if not name or os.path.basename(name) != name:
+            return None
+        path = os.path.join(self.static_dir, name)
+        cached = self._files.get(name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self._files.pop(name, None)
+            return None
+        if cached is None or cached.mtime != mtime:
+            cached = self._files[name] = MediaFile(path, self.max_cached)
+        return cached
+
+    async def serve(self, name, request):
+        """Build the (possibly partial or 304) response for static/<name>, or None if missing."""
+        # A file seen for the first time is read and hashed, so not on the event loop
+        media = await asyncio.to_thread(self.local, name)
+        if media is None:
+            return None
+        if media.data is not None:
+            response = Response(media.data, mimetype=media.mimetype)
+        else:
+            response = Response(FileBody(media.path, buffer_size=self.chunk_size), mimetype=media.mimetype)
+        response.set_etag(media.etag)
+        response.headers["Cache-Control"] = f"public, max-age={ONE_YEAR}, immutable"
+        response.headers["Accept-Ranges"] = "bytes"
+        # Validators only (304/412); the range is resolved below
+        await response.make_conditional(request)
+        if response.status_code != 200 or request.range is None:
+            return response
+        if_range = request.headers.get("If-Range")
+        if if_range and if_range.strip().strip('"') != media.etag:
+            return response  # stale If-Range: send the whole current file
+        if len(request.range.ranges) > 1:
+            return response  # no multipart/byteranges; the full body is a valid answer
+        bounds = request.range.range_for_length(media.size)
+        if bounds is None:
+            return Response("", 416, {"Content-Range": f"bytes */{media.size}"})
+        begin, end = bounds
+        await response.response.make_conditional(begin, end)
+        response.content_length = end - begin
+        response.content_range = ContentRange("bytes", begin, end, media.size)
+        response.status_code = 206
+        return response
+
+    def video_src(self, ad, domain):
+        """URL the ad page should play for an ad config entry ({"file", "video_url"})."""
+        name = ad.get("file")
+        # Existence only: the file is read and hashed when /media first serves it
+        exists = bool(name) and os.path.basename(name) == name and os.path.isfile(os.path.join(self.static_dir, name))
+        local = f"{domain}/media/{name}" if exists else None
+        remote = ad.get("video_url")
+        sources = [local, remote] if self.prefer == "local" else [remote, local]
+        healthy = [src for src in sources if src and (src == local or self._remote_ok.get(src, True))]
+        return (healthy or [src for src in sources if src])[0]
+
+    async def check_remote(self, urls, timeout=5.0):
+        """HEAD every remote URL once and record which ones answer."""
+        async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
+            for url in urls:
+                try:
+                    status = (await client.head(url)).status_code
+                    ok, reason = status < 400, f"HTTP {status}"
+                except httpx.HTTPError as e:
+                    ok, reason = False, str(e) or type(e).__name__
+                if self._remote_ok.get(url, True) != ok:
+                    # Only log transitions; a dead CDN would otherwise log every interval
+                    logger.warning(f"Ad media {url} is now {'healthy' if ok else 'unhealthy'} ({reason})")
+                self._remote_ok[url] = ok
+
+    async def run_health_checks(self, get_urls, interval):
+        """Re-check the remote URLs (get_urls() is re-read each round) every `interval` seconds."""
+        while True:
+            try:
+                await self.check_remote(get_urls())
+            except Exception as e:
+                logger.error(f"Ad media health check failed: {e}")
+            await asyncio.sleep(interval)
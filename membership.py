@@ -0,0 +1,189 @@
+# membership.py — Cached, concurrent group membership checks and the background re-check sweep
+import asyncio
+import json
+import logging
+import time
+
+import ledger
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+MEMBER_STATUSES = ("member", "administrator", "creator")
+
+
+class MembershipChecker:
+    """TTL cache in front of get_chat_member, keyed by (chat, user).
+
+    Positive answers are kept longer than negative ones, so a user who just
+    joined is re-checked soon while confirmed members skip the API call.
+    Failed lookups count as "not a member" and are not cached.
+    """
+
+    def __init__(self, ttl_positive=600.0, ttl_negative=20.0, max_entries=100000):
+        self.ttl_positive = ttl_positive
+        self.ttl_negative = ttl_negative
+        self.max_entries = max_entries
+        self._cache = {}  # (chat, user_id) -> (is_member, expires_at)
+
+    def _get(self, key):
+        hit = self._cache.get(key)
+        if hit is None:
+            return None
+        if hit[1] < time.monotonic():
+            del self._cache[key]
+            return None
+        return hit[0]
+
+    def _put(self, key, is_member):
+        if len(self._cache) >= self.max_entries:
+            # dicts keep insertion order, so this drops the oldest entry
+            del self._cache[next(iter(self._cache))]
+        ttl = self.ttl_positive if is_member else self.ttl_negative
+        self._cache[key] = (is_member, time.monotonic() + ttl)
+
+    async def lookup(self, bot, chat, user_id, limiter=None):
+        """True/False for member or not, None if the API call failed.
+
+        limiter, if given, is acquired before an actual API call (cache hits
+        are free), so a background caller can hold itself to a budget.
+        """
+        key = (chat, int(user_id))
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            member = await bot.get_chat_member(chat_id=chat, user_id=int(user_id))
+        except Exception as e:
+            logger.warning(f"Could not check membership in {chat} for {user_id}: {e}")
+            return None
+        is_member = member.status in MEMBER_STATUSES
+        self._put(key, is_member)
+        return is_member
+
+    async def is_member(self, bot, chat, user_id):
+        return bool(await self.lookup(bot, chat, user_id))
+
+    async def check_all(self, bot, chats, user_id):
+        """Check every chat concurrently; returns a list of bools in `chats` order."""
+        return await asyncio.gather(*(self.is_member(bot, chat, user_id) for chat in chats))
+
+
+# Partial index the sweep walks, newest bonus first; only users paid for joining are in it
+SWEEP_INDEX = """
+CREATE INDEX IF NOT EXISTS users_sweep ON users (COALESCE(last_bonus, ''), user_id) WHERE joined_groups = 1;
+"""
+SWEEP_CURSOR = "membership_sweep_cursor"
+
+
+class MembershipSweeper:
+    """Re-checks users paid the full bonus and punishes those who left a group since.
+
+    Users with joined_groups set are walked most recent claim first, a
+    batch at a time, by keyset on (last_bonus, user_id). The position is
+    saved in the store's meta table after each batch, so a restart or a
+    new leader resumes where the last sweep stopped. Every get_chat_member
+    call the sweep makes takes a token from a bucket refilled at `budget`
+    calls per minute, leaving the rest of Telegram's limits to users;
+    cached answers cost nothing. A user found outside a group is debited
+    `amount` like /punish, with joined_groups cleared in the same
+    transaction so it happens once. Failed lookups punish nobody.
+    """
+
+    def __init__(self, store, checker, chats, budget=60.0, batch=20, amount=60, pause=3600.0):
+        self.store = store
+        self.checker = checker
+        self.chats = chats
+        self.limiter = TokenBucket(budget / 60, capacity=len(chats))
+        self.batch = batch
+        self.amount = amount
+        self.pause = pause
+        self.checked = 0
+        self.punished = 0
+        self.unknown = 0
+        store.connect().executescript(SWEEP_INDEX)
+
+    def _load_cursor(self):
+        row = self.store.connect().execute("SELECT value FROM meta WHERE key = ?", (SWEEP_CURSOR,)).fetchone()
+        return tuple(json.loads(row[0])) if row and row[0] else None
+
+    def _save_cursor(self, cursor):
+        value = json.dumps(cursor) if cursor else None
+
+        def write(db):
+            db.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (SWEEP_CURSOR, value),
+            )
+        return self.store.ledger.submit(write)
+
+    def _next_batch(self, cursor):
+        """The next `batch` (last_bonus, user_id) keys after cursor (from the newest if None)."""
+        db = self.store.connect()
+        # the plain <= lets SQLite seek into the index; the row value alone would scan it
+        if cursor is None:
+            rows = db.execute(
+                "SELECT COALESCE(last_bonus, ''), user_id FROM users WHERE joined_groups = 1 "
+                "ORDER BY COALESCE(last_bonus, '') DESC, user_id DESC LIMIT ?", (self.batch,)
+            )
+        else:
+            rows = db.execute(
+                "SELECT COALESCE(last_bonus, ''), user_id FROM users "
+                "WHERE joined_groups = 1 AND COALESCE(last_bonus, '') <= ? AND (COALESCE(last_bonus, ''), user_id) < (?, ?) "
+                "ORDER BY COALESCE(last_bonus, '') DESC, user_id DESC LIMIT ?", (cursor[0], *cursor, self.batch)
+            )
+        return [tuple(row) for row in rows]
+
+    def _punish(self, user_id):
+        def still_joined(db):
+            row = db.execute("SELECT joined_groups FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            return row is not None and bool(row[0])
+        return self.store.ledger.post(
+            user_id, ledger.PUNISH, -self.amount, {"joined_groups": False}, create=False, guard=still_joined
+        )
+
+    async def check(self, bot, user_id):
+        """Re-check one user; returns their new balance if they were punished, else None."""
+        statuses = await asyncio.gather(
+            *(self.checker.lookup(bot, chat, user_id, self.limiter) for chat in self.chats)
+        )
+        self.checked += 1
+        if None in statuses:
+            self.unknown += 1
+            return None
+        if all(statuses):
+            return None
+        balance = await asyncio.wrap_future(self._punish(user_id))
+        if balance is not None:
+            self.punished += 1
+            logger.info(f"SWEEP_PUNISH: user_id={user_id} balance={balance}")
+        return balance
+
+    async def run(self, bot, on_punish):
+        """Sweep forever (leader only), awaiting on_punish(user_id, balance) for each user punished."""
+        cursor = await asyncio.to_thread(self._load_cursor)
+        while True:
+            try:
+                keys = await asyncio.to_thread(self._next_batch, cursor)
+                if not keys:
+                    logger.info(
+                        f"Membership sweep done: {self.checked} checked, {self.punished} punished, "
+                        f"{self.unknown} unknown so far"
+                    )
+                    cursor = None
+                    await asyncio.wrap_future(self._save_cursor(cursor))
+                    await asyncio.sleep(self.pause)
+                    continue
+                for _, user_id in keys:
+                    balance = await self.check(bot, user_id)
+                    if balance is not None:
+                        await on_punish(user_id, balance)
+                cursor = keys[-1]
+                await asyncio.wrap_future(self._save_cursor(cursor))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Membership sweep batch failed: {e}")
+                await asyncio.sleep(60)
@@ -0,0 +1,153 @@
+# metrics.py — Latency histograms, error counts and in-flight gauges in Prometheus text format
+import bisect
+import functools
+import os
+import threading
+import time
+
+# Upper bounds in seconds; everything slower lands in +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# family -> (metric name prefix, label name, what is being timed)
+FAMILIES = {
+    "handler": ("bot_handler", "handler", "Telegram update handler"),
+    "route": ("bot_http_route", "route", "HTTP route"),
+    "bot_api": ("bot_api_call", "method", "Bot API"),
+    "store": ("bot_store", "op", "User store operation"),
+}
+
+
+class Series:
+    """One timed thing: per-bucket counts (not cumulative), sum, errors and in-flight."""
+
+    __slots__ = ("buckets", "total", "errors", "in_flight")
+
+    def __init__(self, size):
+        self.buckets = [0] * (size + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.errors = 0
+        self.in_flight = 0
+
+
+class Timer:
+    """Context manager for Metrics.timer(); a class rather than a generator to keep it cheap."""
+
+    __slots__ = ("metrics", "family", "name", "started")
+
+    def __init__(self, metrics, family, name):
+        self.metrics = metrics
+        self.family = family
+        self.name = name
+
+    def __enter__(self):
+        self.metrics.begin(self.family, self.name)
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.end(self.family, self.name, time.perf_counter() - self.started, exc_type is not None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Process-wide latency histograms keyed by (family, name).
+
+    Recording is a bisect plus a few increments under one lock, cheap
+    enough to wrap every handler, route, Bot API call and store read.
+    Buckets are stored per slot and only made cumulative when /metrics
+    renders them. Every series carries a worker="<pid>" label: under
+    gunicorn each scrape reaches one worker, and the label keeps their
+    counters apart instead of letting them look like resets.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.bounds = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # (family, name) -> Series
+
+    def _get(self, family, name):
+        key = (family, name)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series.setdefault(key, Series(len(self.bounds)))
+        return series
+
+    def begin(self, family, name):
+        with self._lock:
+            self._get(family, name).in_flight += 1
+
+    def end(self, family, name, seconds, error=False):
+        """Record one finished call that took `seconds`."""
+        i = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            series = self._get(family, name)
+            series.in_flight -= 1
+            series.buckets[i] += 1
+            series.total += seconds
+            if error:
+                series.errors += 1
+
+    def timer(self, family, name):
+        """Time a synchronous block; an exception escaping it counts as an error."""
+        return Timer(self, family, name)
+
+    def track(self, func, family, name=None, expected=()):
+        """Wrap an async callable so each call is timed under (family, name).
+
+        Exceptions in `expected` (control flow such as ApplicationHandlerStop)
+        are re-raised without counting as errors.
+        """
+        name = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            self.begin(family, name)
+            started = time.perf_counter()
+            error = True
+            try:
+                result = await func(*args, **kwargs)
+                error = False
+                return result
+            except expected:
+                error = False
+                raise
+            finally:
+                self.end(family, name, time.perf_counter() - started, error)
+        return wrapper
+
+    def render(self):
+        """Everything recorded so far, in the Prometheus text exposition format."""
+        worker = f'worker="{os.getpid()}"'
+        with self._lock:
+            snapshot = {
+                key: (list(s.buckets), s.total, s.errors, s.in_flight) for key, s in sorted(self._series.items())
+            }
+        lines = []
+        for family, (prefix, label, what) in FAMILIES.items():
+            rows = [(name, data) for (fam, name), data in snapshot.items() if fam == family]
+            if not rows:
+                continue
+            lines.append(f"# HELP {prefix}_seconds {what} latency in seconds.")
+            lines.append(f"# TYPE {prefix}_seconds histogram")
+            for name, (buckets, total, _, _) in rows:
+                labels = f'{worker},{label}="{_escape(name)}"'
+                cumulative = 0
+                for bound, count in zip(self.bounds + ("+Inf",), buckets):
+                    cumulative += count
+                    lines.append(f'{prefix}_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{prefix}_seconds_sum{{{labels}}} {total:.6f}")
+                lines.append(f"{prefix}_seconds_count{{{labels}}} {cumulative}")
+            lines.append(f"# HELP {prefix}_errors_total {what} calls that raised or failed.")
+            lines.append(f"# TYPE {prefix}_errors_total counter")
+            for name, (_, _, errors, _) in rows:
+                lines.append(f'{prefix}_errors_total{{{worker},{label}="{_escape(name)}"}} {errors}')
+            lines.append(f"# HELP {prefix}_in_flight {what} calls currently running.")
+            lines.append(f"# TYPE {prefix}_in_flight gauge")
+            for name, (_, _, _, in_flight) in rows:
+                lines.append(f'{prefix}_in_flight{{{worker},{label}="{_escape(name)}"}} {in_flight}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,76 @@
+# outbox.py — Shared outbound message dispatcher for the bot
+import asyncio
+import logging
+
+from telegram.error import Forbidden, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """Bounded queue of outgoing messages drained by a fixed pool of workers.
+
+    Producers call send() from the bot's event loop; it never blocks. Plain
+    text messages queued for the same chat before a worker picks them up are
+    merged into a single sendMessage call. Workers share tg_app.bot, so every
+    send reuses its pooled HTTP connections. Messages queued before start()
+    (while tg_app is still warming up) are delivered once it runs.
+    """
+
+    def __init__(self, maxsize=10000, workers=8):
+        self.maxsize = maxsize
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize)
+        self._pending = {}  # chat_id -> texts waiting to be merged into one send
+        self._tasks = []
+        self.bot = None
+        self.dropped = 0
+
+    async def start(self, bot):
+        self.bot = bot
+        self._tasks = [asyncio.create_task(self._worker(), name=f"outbox-{i}") for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def send(self, chat_id, text, **kwargs):
+        """Queue a message. Returns False if the outbox is full."""
+        chat_id = int(chat_id)
+        if not kwargs and chat_id in self._pending:
+            self._pending[chat_id].append(text)
+            return True
+        item = (chat_id, None, text, kwargs) if kwargs else (chat_id, True, None, None)
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Outbox full, dropping message to {chat_id}")
+            return False
+        if not kwargs:
+            self._pending[chat_id] = [text]
+        return True
+
+    async def _worker(self):
+        while True:
+            chat_id, merged, text, kwargs = await self._queue.get()
+            if merged:
+                text = "\n\n".join(self._pending.pop(chat_id))
+                kwargs = {}
+            try:
+                await self._deliver(chat_id, text, kwargs)
+            except Exception as e:
+                logger.error(f"Error sending message to {chat_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, chat_id, text, kwargs):
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except Forbidden:
+            logger.info(f"User {chat_id} blocked the bot")
@@ -0,0 +1,95 @@
+# profiler.py — Opt-in sampling profiler that counts the hottest thread stacks
+import asyncio
+import os
+import sys
+import threading
+from collections import Counter
+
+# Innermost frames of a thread that is blocked waiting, not doing work
+IDLE_LEAVES = frozenset((
+    "selectors.py:select",  # event loop with nothing ready
+    "threading.py:wait",
+    "thread.py:_worker",  # to_thread pool worker blocked on its queue
+))
+
+
+class StackSampler:
+    """Samples every thread's Python stack every `interval` seconds.
+
+    Stacks are folded root-first into "thread;file:function;..." strings
+    (the collapsed format flamegraph.pl and speedscope read) and counted.
+    Threads parked in IDLE_LEAVES are tallied as idle instead, so the
+    top stacks are where time is actually spent. Nothing runs until
+    start(); while running the cost is one walk of sys._current_frames()
+    per tick on a background thread.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.idle = 0
+        self._counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        self._counts = Counter()
+        self.samples = 0
+        self.idle = 0
+
+    def _fold(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            threads = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                code = frame.f_code
+                if f"{os.path.basename(code.co_filename)}:{code.co_name}" in IDLE_LEAVES:
+                    self.idle += 1
+                    continue
+                self._counts[f"{threads.get(ident, ident)};{self._fold(frame)}"] += 1
+            self.samples += 1
+
+    async def sample_for(self, seconds):
+        """Sample for `seconds` (from a clean slate) and stop again."""
+        self.reset()
+        self.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(self.stop)
+
+    def top(self, n=10):
+        """The n most frequently sampled stacks (all of them for n=None) as [(stack, count)]."""
+        return self._counts.most_common(n)
+
+    def collapsed(self):
+        """Every sampled stack as "stack count" lines, hottest first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self._counts.most_common())
@@ -0,0 +1,188 @@
+# ratelimit.py — Sliding-window rate limits for handlers and routes, token buckets for pacing sends
+import asyncio
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key    TEXT PRIMARY KEY,
+    window INTEGER NOT NULL,
+    prev   INTEGER NOT NULL,
+    cur    INTEGER NOT NULL
+);
+"""
+
+
+def parse_limits(spec):
+    """Parse 'action=count/seconds,...' (e.g. 'ad=5/60,global=500/1') into {action: (count, seconds)}."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        action, _, rule = item.partition("=")
+        count, _, seconds = rule.partition("/")
+        limits[action.strip()] = (int(count), float(seconds or 1))
+    return limits
+
+
+def _slide(state, now, limit, window):
+    """Sliding-window counter step: returns (new_state, retry_after); retry_after 0 means allowed.
+
+    state is (window_index, previous_count, current_count). The rate is
+    estimated as the previous window's count weighted by how much of it
+    still overlaps the sliding window, plus the current window's count.
+    """
+    index = math.floor(now / window)
+    w, prev, cur = state or (index, 0, 0)
+    if index == w + 1:
+        prev, cur = cur, 0
+    elif index != w:
+        prev, cur = 0, 0
+    elapsed = now - index * window
+    if prev * (1 - elapsed / window) + cur + 1 <= limit:
+        return (index, prev, cur + 1), 0.0
+    if cur + 1 > limit or prev == 0:
+        retry = window - elapsed  # only the next window can make room
+    else:
+        # the previous window's weight decays linearly; wait until it leaves room for one more
+        retry = window * (1 - (limit - 1 - cur) / prev) - elapsed
+    return (index, prev, cur), max(retry, 0.001)
+
+
+class MemoryBackend:
+    """Per-process counters: {key: (window_index, prev, cur)}."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._state = {}
+
+    async def hit(self, key, limit, window, now):
+        state, retry = _slide(self._state.get(key), now, limit, window)
+        if key not in self._state and len(self._state) >= self.max_keys:
+            # dicts keep insertion order, so this drops the oldest key
+            del self._state[next(iter(self._state))]
+        self._state[key] = state
+        return retry
+
+
+class SQLiteBackend:
+    """Counters in the user store's database, shared by every worker process.
+
+    Every `purge_every` seconds, rows last hit two or more windows ago are
+    deleted (their counts no longer matter), so the table holds only the
+    keys active recently rather than every user and address ever seen.
+    """
+
+    def __init__(self, store, purge_every=300.0):
+        self.store = store
+        self.purge_every = purge_every
+        self._purged = time.time()
+        self._windows = {}  # action -> window length, as seen by hit()
+        self.store.connect().executescript(SCHEMA)
+
+    def _purge(self, db, now):
+        purged = 0
+        for action, window in self._windows.items():
+            # keys are "action:key"; ';' sorts right after ':', so this is a range scan of one action
+            purged += db.execute(
+                "DELETE FROM rate_limits WHERE key >= ? AND key < ? AND window < ?",
+                (f"{action}:", f"{action};", math.floor(now / window) - 1),
+            ).rowcount
+        if purged:
+            logger.info(f"Purged {purged} idle rate limit counters")
+
+    def _hit(self, key, limit, window, now):
+        self._windows[key.partition(":")[0]] = window
+        with self.store.transaction() as db:
+            if now - self._purged >= self.purge_every:
+                self._purged = now
+                self._purge(db, now)
+            row = db.execute("SELECT window, prev, cur FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            state, retry = _slide(tuple(row) if row else None, now, limit, window)
+            db.execute(
+                "INSERT INTO rate_limits (key, window, prev, cur) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET window = excluded.window, prev = excluded.prev, cur = excluded.cur",
+                (key, *state),
+            )
+        return retry
+
+    async def hit(self, key, limit, window, now):
+        return await asyncio.to_thread(self._hit, key, limit, window, now)
+
+
+class RateLimiter:
+    """Per-key sliding-window limits, configured per action.
+
+    Once a key is rejected, the time it is blocked until is remembered in
+    process memory, so further rejections during that block are a dict
+    lookup and never reach the backend (or the database). The "global"
+    action, if configured, caps the combined rate of every other action.
+    """
+
+    def __init__(self, limits, backend=None, max_blocked=100000):
+        self.limits = limits
+        self.backend = backend or MemoryBackend()
+        self.max_blocked = max_blocked
+        self._blocked = {}  # "action:key" -> blocked until (time.time())
+
+    def _block(self, bucket, until):
+        if len(self._blocked) >= self.max_blocked:
+            del self._blocked[next(iter(self._blocked))]
+        self._blocked[bucket] = until
+
+    async def _check_one(self, action, key, now):
+        bucket = f"{action}:{key}"
+        until = self._blocked.get(bucket)
+        if until is not None:
+            if until > now:
+                return until - now
+            del self._blocked[bucket]
+        limit, window = self.limits[action]
+        retry = await self.backend.hit(bucket, limit, window, now)
+        if retry:
+            self._block(bucket, now + retry)
+        return retry
+
+    async def check(self, action, key, count_global=True):
+        """Count one hit of action by key. Returns 0.0 if allowed, else seconds until retry.
+
+        count_global=False leaves out the "global" cap, for a second check
+        within a request that has already been counted against it.
+        """
+        now = time.time()
+        for name, bucket_key in ((action, key), ("global", "*")):
+            if name in self.limits and (count_global or name != "global"):
+                retry = await self._check_one(name, bucket_key, now)
+                if retry:
+                    return retry
+        return 0.0
+
+
+class TokenBucket:
+    """Async token bucket allowing `rate` acquisitions per second, bursting to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def pause(self, seconds):
+        """Hold back every caller for `seconds` (used when Telegram answers RetryAfter)."""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
@@ -0,0 +1,80 @@
+# referral.py — Referral tracking with per-referrer counters
+import asyncio
+import logging
+from datetime import datetime
+
+import ledger
+
+logger = logging.getLogger(__name__)
+
+# referrals.referee is the primary key, so a user can only ever be referred
+# once; referral_counts is bumped in the same transaction as the reward.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS referrals (
+    referee    TEXT PRIMARY KEY,
+    referrer   TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS referrals_referrer ON referrals (referrer);
+CREATE TABLE IF NOT EXISTS referral_counts (
+    referrer TEXT PRIMARY KEY,
+    referred INTEGER NOT NULL DEFAULT 0,
+    earned   REAL NOT NULL DEFAULT 0
+);
+"""
+
+
+class Referrals:
+    """Records referrer -> referee pairs and pays the referrer through the ledger.
+
+    Only users the store has never seen can be referred, nobody can refer
+    themselves, and the referrer must already exist. The checks, the
+    referral row, the counter bump and the ledger credit all run inside the
+    ledger's group-committed transaction, so they apply together or not at all.
+    """
+
+    def __init__(self, store, reward):
+        self.store = store
+        self.reward = reward
+        self.store.connect().executescript(SCHEMA)
+
+    def _guard(self, referrer, referee):
+        def guard(db):
+            if not db.execute("SELECT 1 FROM users WHERE user_id = ?", (referrer,)).fetchone():
+                return False
+            if db.execute("SELECT 1 FROM users WHERE user_id = ?", (referee,)).fetchone():
+                return False
+            cur = db.execute(
+                "INSERT OR IGNORE INTO referrals (referee, referrer, created_at) VALUES (?, ?, ?)",
+                (referee, referrer, datetime.utcnow().isoformat()),
+            )
+            if cur.rowcount == 0:
+                return False
+            db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (referee,))
+            db.execute(
+                "INSERT INTO referral_counts (referrer, referred, earned) VALUES (?, 1, ?) "
+                "ON CONFLICT (referrer) DO UPDATE SET referred = referred + 1, earned = earned + excluded.earned",
+                (referrer, self.reward),
+            )
+            return True
+        return guard
+
+    async def record(self, referrer, referee):
+        """Record that referrer brought in referee; returns True if it counted."""
+        referrer, referee = str(referrer), str(referee)
+        if not referrer.isdigit() or referrer == referee:
+            return False
+        balance = await asyncio.wrap_future(
+            self.store.ledger.post(referrer, ledger.REFERRAL, self.reward, create=False, guard=self._guard(referrer, referee))
+        )
+        if balance is None:
+            return False
+        logger.info(f"👥 Referral recorded: {referrer} -> {referee}")
+        return True
+
+    def summary(self, user_id):
+        """Return (users referred, amount earned) for a referrer."""
+        row = self.store.connect().execute(
+            "SELECT referred, earned FROM referral_counts WHERE referrer = ?", (str(user_id),)
+        ).fetchone()
+        return (row[0], round(row[1], 2)) if row else (0, 0.0)
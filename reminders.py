@@ -0,0 +1,134 @@
+# reminders.py — "Your bonus is ready" reminders from a min-heap of due times
+import asyncio
+import heapq
+import logging
+import time
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bonus_reminders (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL UNIQUE,
+    due_at  REAL NOT NULL
+);
+"""
+
+# One-off when the table is created: users still inside their cooldown get a reminder too
+BACKFILL = """
+INSERT OR IGNORE INTO bonus_reminders (user_id, due_at)
+SELECT user_id, (julianday(last_bonus) - 2440587.5) * 86400.0 + ?
+FROM users WHERE last_bonus >= ?
+ORDER BY last_bonus
+"""
+
+
+class BonusReminders:
+    """Messages users when their bonus cooldown is over.
+
+    A claim stores (user_id, due_at) in bonus_reminders through the
+    ledger writer; a later claim replaces the row. The worker holding the
+    leader lease runs run(): it rebuilds a min-heap of due times from the
+    table once, then each tick reads only rows with a higher id than the
+    last one seen and pops what is due, so a tick costs O(new + due · log n)
+    however many users there are. Replaced entries are skipped when popped.
+    Reminders go out through the outbox behind a token bucket, and the
+    sent rows are deleted in one write per batch.
+    """
+
+    def __init__(self, store, send, text, cooldown, rate=10.0, tick=5.0, batch=500):
+        self.store = store
+        self.send = send  # send(chat_id, text) -> False if it could not be queued
+        self.text = text
+        self.cooldown = cooldown
+        self.limiter = TokenBucket(rate)
+        self.tick = tick
+        self.batch = batch
+        self.sent = 0
+        self._heap = []  # (due_at, user_id)
+        self._due = {}  # user_id -> due_at of its live heap entry
+        self._last_id = 0
+        self._init_schema()
+
+    def _init_schema(self):
+        exists = "SELECT 1 FROM sqlite_master WHERE name = 'bonus_reminders'"
+        if self.store.connect().execute(exists).fetchone():
+            return
+        since = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(time.time() - self.cooldown))
+        with self.store.transaction() as db:
+            if db.execute(exists).fetchone():
+                return  # another worker created it while we waited for the write lock
+            db.execute(SCHEMA)
+            db.execute(BACKFILL, (self.cooldown, since))
+
+    def schedule(self, user_id, due_at):
+        """Remind user_id at due_at (epoch seconds), replacing any earlier reminder."""
+        user_id = str(user_id)
+
+        def write(db):
+            db.execute(
+                "INSERT OR REPLACE INTO bonus_reminders (user_id, due_at) VALUES (?, ?)", (user_id, due_at)
+            )
+        return self.store.ledger.submit(write)
+
+    def _sync(self):
+        """Push reminders added since the last call onto the heap."""
+        rows = self.store.connect().execute(
+            "SELECT id, user_id, due_at FROM bonus_reminders WHERE id > ? ORDER BY id", (self._last_id,)
+        ).fetchall()
+        for row_id, user_id, due_at in rows:
+            self._last_id = row_id
+            if self._due.get(user_id) != due_at:
+                self._due[user_id] = due_at
+                heapq.heappush(self._heap, (due_at, user_id))
+        return len(rows)
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch:
+            due_at, user_id = heapq.heappop(self._heap)
+            if self._due.get(user_id) == due_at:
+                del self._due[user_id]
+                due.append((user_id, due_at))
+        return due
+
+    def _forget(self, sent):
+        def write(db):
+            # due_at too, so a reminder rescheduled meanwhile survives
+            db.executemany("DELETE FROM bonus_reminders WHERE user_id = ? AND due_at = ?", sent)
+        return self.store.ledger.submit(write)
+
+    def pending(self):
+        return len(self._due)
+
+    async def run(self):
+        """Leader loop: rebuild the heap from storage, then send reminders as they fall due."""
+        self._heap, self._due, self._last_id = [], {}, 0
+        loaded = await asyncio.to_thread(self._sync)
+        logger.info(f"Bonus reminders: {loaded} pending")
+        while True:
+            try:
+                await asyncio.to_thread(self._sync)
+                due = self._pop_due(time.time())
+                sent = []
+                for user_id, due_at in due:
+                    await self.limiter.acquire()
+                    if self.send(user_id, self.text):
+                        sent.append((user_id, due_at))
+                    else:
+                        # outbox full: try again next tick
+                        self._due[user_id] = due_at
+                        heapq.heappush(self._heap, (due_at, user_id))
+                if sent:
+                    self.sent += len(sent)
+                    await asyncio.wrap_future(self._forget(sent))
+                    logger.info(f"Sent {len(sent)} bonus reminders, {len(self._due)} pending")
+                if len(sent) == self.batch:
+                    continue  # more may be due already; the token bucket paces us
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Bonus reminder tick failed: {e}")
+            await asyncio.sleep(self.tick)
@@ -0,0 +1,108 @@
+# stats.py — Running aggregates for /stats, kept current by SQLite triggers
+import asyncio
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Every users/ledger write bumps these counters in the same transaction,
+# so reading them is O(1) no matter how many users there are.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stats (
+    key   TEXT PRIMARY KEY,
+    value REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS daily_stats (
+    day   TEXT NOT NULL,
+    key   TEXT NOT NULL,
+    value REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, key)
+);
+CREATE TRIGGER IF NOT EXISTS stats_users_ins AFTER INSERT ON users BEGIN
+    INSERT INTO stats (key, value) VALUES ('total_users', 1), ('total_balance', new.balance), ('joined_both', new.joined_groups)
+    ON CONFLICT (key) DO UPDATE SET value = value + excluded.value;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_users_del AFTER DELETE ON users BEGIN
+    INSERT INTO stats (key, value) VALUES ('total_users', -1), ('total_balance', -old.balance), ('joined_both', -old.joined_groups)
+    ON CONFLICT (key) DO UPDATE SET value = value + excluded.value;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_users_balance AFTER UPDATE OF balance ON users WHEN new.balance != old.balance BEGIN
+    INSERT INTO stats (key, value) VALUES ('total_balance', new.balance - old.balance)
+    ON CONFLICT (key) DO UPDATE SET value = value + excluded.value;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_users_joined AFTER UPDATE OF joined_groups ON users WHEN new.joined_groups != old.joined_groups BEGIN
+    INSERT INTO stats (key, value) VALUES ('joined_both', new.joined_groups - old.joined_groups)
+    ON CONFLICT (key) DO UPDATE SET value = value + excluded.value;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_ledger_ad AFTER INSERT ON ledger WHEN new.kind = 'ad_reward' BEGIN
+    INSERT INTO daily_stats (day, key, value) VALUES (substr(new.created_at, 1, 10), 'ads_watched', 1)
+    ON CONFLICT (day, key) DO UPDATE SET value = value + excluded.value;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_ledger_bonus AFTER INSERT ON ledger WHEN new.kind IN ('bonus_one_group', 'bonus_both') BEGIN
+    INSERT INTO daily_stats (day, key, value) VALUES (substr(new.created_at, 1, 10), 'bonuses_paid', 1),
+        (substr(new.created_at, 1, 10), 'bonus_amount', new.amount)
+    ON CONFLICT (day, key) DO UPDATE SET value = value + excluded.value;
+END;
+"""
+
+
+class Stats:
+    """O(1) aggregate reads plus a full-scan reconciliation to catch drift."""
+
+    def __init__(self, store):
+        self.store = store
+        db = store.connect()
+        if not db.execute("SELECT 1 FROM sqlite_master WHERE name = 'stats'").fetchone():
+            db.executescript("BEGIN IMMEDIATE;" + SCHEMA + "COMMIT;")
+            # Seed the counters from whatever is already in the store
+            self.reconcile()
+
+    def snapshot(self):
+        """Return the current aggregates as a dict."""
+        db = self.store.connect()
+        totals = dict(db.execute("SELECT key, value FROM stats").fetchall())
+        today = datetime.utcnow().date().isoformat()
+        daily = dict(db.execute("SELECT key, value FROM daily_stats WHERE day = ?", (today,)).fetchall())
+        return {
+            "total_users": int(totals.get("total_users", 0)),
+            "joined_both": int(totals.get("joined_both", 0)),
+            "total_balance": round(totals.get("total_balance", 0.0), 2),
+            "ads_watched_today": int(daily.get("ads_watched", 0)),
+            "bonuses_paid_today": int(daily.get("bonuses_paid", 0)),
+            "bonus_amount_today": round(daily.get("bonus_amount", 0.0), 2),
+        }
+
+    def _recompute(self, db):
+        total_users, total_balance, joined_both = db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(balance), 0), COALESCE(SUM(joined_groups), 0) FROM users"
+        ).fetchone()
+        return {"total_users": total_users, "total_balance": total_balance, "joined_both": joined_both}
+
+    def reconcile(self):
+        """Recompute the totals from the user records, fix any drift and return it.
+
+        Returns {key: (stored, actual)} for every counter that had drifted.
+        """
+        with self.store.transaction() as db:
+            actual = self._recompute(db)
+            stored = dict(db.execute("SELECT key, value FROM stats").fetchall())
+            drift = {}
+            for key, value in actual.items():
+                if abs(stored.get(key, 0) - value) > 0.005:
+                    drift[key] = (stored.get(key, 0), value)
+                db.execute(
+                    "INSERT INTO stats (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    (key, value),
+                )
+        if drift:
+            logger.warning(f"Stats drift corrected: {drift}")
+        return drift
+
+    async def run_reconciler(self, interval):
+        """Reconcile every `interval` seconds, off the event loop thread."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.reconcile)
+            except Exception as e:
+                logger.error(f"Stats reconciliation failed: {e}")
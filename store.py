@@ -0,0 +1,430 @@
+# store.py — User storage backends for bot.py
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from iostats import io_stats
+from ledger import Ledger, OPENING_BALANCE
+from metrics import metrics
+from stats import Stats
+
+logger = logging.getLogger(__name__)
+
+# Fields a user record may carry (besides the user id itself)
+USER_FIELDS = ("balance", "joined_groups", "first_name", "username", "joined_at", "last_bonus")
+
+# What an unknown user looks like; never stored until something is credited
+DEFAULT_RECORD = {"balance": 0.0, "joined_groups": False}
+
+
+class UserStore:
+    """Keyed-by-user-id storage API used by the bot handlers.
+
+    User ids are strings (Telegram numeric ids, as in the old users.json keys).
+    Records are plain dicts with the keys in USER_FIELDS; unset fields are omitted.
+    """
+
+    def get(self, user_id):
+        """Return the user's record, or None if the user is unknown."""
+        raise NotImplementedError
+
+    def get_or_default(self, user_id):
+        """Return the user's record, or a default one if unknown. Never writes."""
+        rec = self.get(user_id)
+        return rec if rec is not None else dict(DEFAULT_RECORD)
+
+    async def aget(self, user_id):
+        """get() for coroutines: the read happens off the event loop thread."""
+        return await asyncio.to_thread(self.get, user_id)
+
+    async def aget_or_default(self, user_id):
+        """get_or_default() for coroutines: the read happens off the event loop thread."""
+        return await asyncio.to_thread(self.get_or_default, user_id)
+
+    async def aregister(self, user_id):
+        """Store a default record for a user who started the bot. Returns True if it was new."""
+        raise NotImplementedError
+
+    async def aupdate(self, user_id, **fields):
+        """Set fields on an existing user. Returns False if the user is unknown.
+
+        A field set to None is cleared. Unchanged values are not written back.
+        """
+        raise NotImplementedError
+
+    async def acredit(self, user_id, amount, kind, **fields):
+        """Atomically add amount to the balance (creating the user if needed).
+
+        kind is the ledger entry type (see ledger.py). Extra fields are written
+        in the same transaction. Returns the new balance.
+        """
+        raise NotImplementedError
+
+    async def adebit(self, user_id, amount, kind, **fields):
+        """Atomically subtract amount from an existing user's balance.
+
+        Returns the new balance, or None if the user is unknown.
+        """
+        raise NotImplementedError
+
+    async def acredit_if_idle(self, user_id, amount, kind, stamp, since, **fields):
+        """acredit() only if the user's `stamp` field is unset or older than `since` (ISO time).
+
+        The check runs in the same write transaction as the credit, so
+        concurrent claims (from any worker process) pay out once. Pass the
+        new stamp in fields. Returns the new balance, or None if the stamp
+        was too recent.
+        """
+        raise NotImplementedError
+
+    def page_ids(self, after, limit):
+        """Return up to limit user ids greater than `after`, in user id order."""
+        raise NotImplementedError
+
+    def find_by_username(self, username):
+        """Return the ids of users whose username matches exactly (case-insensitive)."""
+        raise NotImplementedError
+
+    def search(self, query, limit, offset=0):
+        """Return up to limit (user_id, record) pairs whose username or first name contains query."""
+        raise NotImplementedError
+
+    def recent_claimers(self, limit, offset=0):
+        """Return (user_id, record) pairs of bonus claimers, newest joined_at first."""
+        raise NotImplementedError
+
+    def migrate_from_json(self, path):
+        """One-shot import of a legacy users.json file. Returns the number of users imported."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteUserStore(UserStore):
+    """UserStore backed by a SQLite database in WAL mode.
+
+    Every read or write is a point lookup on the primary key, so per-event cost
+    does not grow with the number of users. Each thread gets its own connection.
+    Balance changes go through the append-only ledger (self.ledger), and so
+    do field writes: its writer thread group-commits them, so no write
+    transaction runs on the caller's thread.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id       TEXT PRIMARY KEY,
+        balance       REAL NOT NULL DEFAULT 0,
+        joined_groups INTEGER NOT NULL DEFAULT 0,
+        first_name    TEXT,
+        username      TEXT,
+        joined_at     TEXT,
+        last_bonus    TEXT,
+        updated_at    TEXT
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key   TEXT PRIMARY KEY,
+        value TEXT
+    );
+    CREATE INDEX IF NOT EXISTS users_username ON users (username COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS users_first_name ON users (first_name COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS users_joined_at ON users (joined_at);
+    """
+
+    # updated_at is stamped by triggers on every insert/update (for incremental exports)
+    TOUCH_SCHEMA = """
+    CREATE INDEX IF NOT EXISTS users_updated_at ON users (updated_at);
+    CREATE TRIGGER IF NOT EXISTS users_touch_ins AFTER INSERT ON users WHEN new.updated_at IS NULL BEGIN
+        UPDATE users SET updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now') WHERE rowid = new.rowid;
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_touch_upd AFTER UPDATE ON users WHEN new.updated_at IS old.updated_at BEGIN
+        UPDATE users SET updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now') WHERE rowid = new.rowid;
+    END;
+    """
+
+    # Trigram full-text index over username/first_name for substring search,
+    # kept in sync with the users table by triggers
+    SEARCH_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5(
+        username, first_name, content='users', content_rowid='rowid', tokenize='trigram'
+    );
+    CREATE TRIGGER IF NOT EXISTS users_search_ins AFTER INSERT ON users BEGIN
+        INSERT INTO users_search (rowid, username, first_name) VALUES (new.rowid, new.username, new.first_name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_search_del AFTER DELETE ON users BEGIN
+        INSERT INTO users_search (users_search, rowid, username, first_name)
+        VALUES ('delete', old.rowid, old.username, old.first_name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_search_upd AFTER UPDATE OF username, first_name ON users BEGIN
+        INSERT INTO users_search (users_search, rowid, username, first_name)
+        VALUES ('delete', old.rowid, old.username, old.first_name);
+        INSERT INTO users_search (rowid, username, first_name) VALUES (new.rowid, new.username, new.first_name);
+    END;
+    INSERT INTO users_search (users_search) VALUES ('rebuild');
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        db = self.connect()
+        db.executescript(self.SCHEMA)
+        if "updated_at" not in [row["name"] for row in db.execute("PRAGMA table_info(users)")]:
+            try:
+                db.execute("ALTER TABLE users ADD COLUMN updated_at TEXT")
+            except sqlite3.OperationalError as e:
+                # another worker process added it first
+                if "duplicate column" not in str(e):
+                    raise
+        db.executescript(self.TOUCH_SCHEMA)
+        self.has_search_index = self._create_search_index()
+        self.ledger = Ledger(self)
+        self.stats = Stats(self)
+
+    def connect(self):
+        """Return this thread's connection, opening it on first use."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA busy_timeout=5000")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def transaction(self):
+        """Run a block of statements as one write transaction."""
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _create_search_index(self):
+        db = self.connect()
+        if db.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_search'").fetchone():
+            return True
+        try:
+            db.executescript("BEGIN IMMEDIATE;" + self.SEARCH_SCHEMA + "COMMIT;")
+        except sqlite3.OperationalError as e:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            # SQLite built without FTS5 trigram support: search() falls back to a scan
+            logger.warning(f"Trigram search index unavailable, /find will scan: {e}")
+            return False
+        return True
+
+    @staticmethod
+    def _record(row):
+        if row is None:
+            return None
+        rec = {"balance": row["balance"], "joined_groups": bool(row["joined_groups"])}
+        for key in ("first_name", "username", "joined_at", "last_bonus"):
+            if row[key] is not None:
+                rec[key] = row[key]
+        return rec
+
+    @staticmethod
+    def _check_fields(fields):
+        for key in fields:
+            if key not in USER_FIELDS or key == "balance":
+                raise ValueError(f"Unknown user field: {key}")
+
+    def set_fields(self, db, user_id, fields):
+        """Write non-balance fields for user_id inside an open transaction."""
+        if not fields:
+            return
+        self._check_fields(fields)
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        db.execute(f"UPDATE users SET {cols} WHERE user_id = ?", (*fields.values(), user_id))
+
+    def _select(self, db, user_id):
+        with metrics.timer("store", "select"):
+            return db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+
+    @staticmethod
+    def _unchanged(row, fields):
+        return row is not None and all(row[k] == v for k, v in fields.items())
+
+    def get(self, user_id):
+        io_stats.read()
+        return self._record(self._select(self.connect(), str(user_id)))
+
+    async def aregister(self, user_id):
+        user_id = str(user_id)
+        io_stats.write({"user_id": user_id})
+        future = self.ledger.submit(
+            lambda db: db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,)).rowcount > 0
+        )
+        return await asyncio.wrap_future(future)
+
+    def _submit_update(self, user_id, fields):
+        """Return (result, None) if nothing needs writing, else (None, Future of the result)."""
+        user_id = str(user_id)
+        self._check_fields(fields)
+        io_stats.read()
+        row = self._select(self.connect(), user_id)
+        if row is None:
+            return False, None
+        if self._unchanged(row, fields):
+            return True, None
+        io_stats.write({"user_id": user_id, **fields})
+
+        def write(db):
+            if self._select(db, user_id) is None:
+                return False
+            self.set_fields(db, user_id, fields)
+            return True
+        return None, self.ledger.submit(write)
+
+    async def aupdate(self, user_id, **fields):
+        result, future = self._submit_update(user_id, fields)
+        return result if future is None else await asyncio.wrap_future(future)
+
+    def _post(self, user_id, amount, kind, fields, create=True):
+        self._check_fields(fields)
+        io_stats.write({"user_id": str(user_id), "kind": kind, "amount": amount, **fields})
+        return self.ledger.post(user_id, kind, amount, fields, create=create)
+
+    async def acredit(self, user_id, amount, kind, **fields):
+        return await asyncio.wrap_future(self._post(user_id, amount, kind, fields))
+
+    async def adebit(self, user_id, amount, kind, **fields):
+        return await asyncio.wrap_future(self._post(user_id, -amount, kind, fields, create=False))
+
+    async def acredit_if_idle(self, user_id, amount, kind, stamp, since, **fields):
+        if stamp not in USER_FIELDS:
+            raise ValueError(f"Unknown user field: {stamp}")
+        self._check_fields(fields)
+        user_id = str(user_id)
+
+        def idle(db):
+            row = db.execute(f"SELECT {stamp} FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            return row is None or row[0] is None or row[0] < since
+        io_stats.write({"user_id": user_id, "kind": kind, "amount": amount, **fields})
+        return await asyncio.wrap_future(self.ledger.post(user_id, kind, amount, fields, guard=idle))
+
+    def page_ids(self, after, limit):
+        rows = self.connect().execute(
+            "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, limit)
+        )
+        return [row[0] for row in rows]
+
+    def find_by_username(self, username):
+        rows = self.connect().execute(
+            "SELECT user_id FROM users WHERE username = ? COLLATE NOCASE", (username,)
+        )
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def _like_pattern(query, prefix_only=False):
+        escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return escaped + "%" if prefix_only else "%" + escaped + "%"
+
+    def search(self, query, limit, offset=0):
+        db = self.connect()
+        if len(query) < 3:
+            # Too short for trigrams: walk the username and first_name indexes in order,
+            # offset + limit rows from each, and merge them by whichever name matched
+            pattern = self._like_pattern(query, prefix_only=True)
+            rows = db.execute(
+                "SELECT users.* FROM users JOIN ("
+                " SELECT rid, MIN(name COLLATE NOCASE) AS name FROM ("
+                "  SELECT * FROM (SELECT rowid AS rid, username AS name FROM users"
+                "   WHERE username LIKE ?1 ESCAPE '\\' ORDER BY username COLLATE NOCASE, rowid LIMIT ?2)"
+                "  UNION ALL"
+                "  SELECT * FROM (SELECT rowid AS rid, first_name AS name FROM users"
+                "   WHERE first_name LIKE ?1 ESCAPE '\\' ORDER BY first_name COLLATE NOCASE, rowid LIMIT ?2)"
+                " ) GROUP BY rid"
+                ") AS matched ON users.rowid = matched.rid "
+                "ORDER BY matched.name COLLATE NOCASE, matched.rid LIMIT ?3 OFFSET ?4",
+                (pattern, offset + limit, limit, offset),
+            )
+        elif self.has_search_index:
+            rows = db.execute(
+                "SELECT users.* FROM users_search JOIN users ON users.rowid = users_search.rowid "
+                "WHERE users_search MATCH ? LIMIT ? OFFSET ?",
+                ('"' + query.replace('"', '""') + '"', limit, offset),
+            )
+        else:
+            pattern = self._like_pattern(query)
+            rows = db.execute(
+                "SELECT * FROM users WHERE username LIKE ? ESCAPE '\\' OR first_name LIKE ? ESCAPE '\\' "
+                "LIMIT ? OFFSET ?",
+                (pattern, pattern, limit, offset),
+            )
+        return [(row["user_id"], self._record(row)) for row in rows]
+
+    def recent_claimers(self, limit, offset=0):
+        rows = self.connect().execute(
+            "SELECT * FROM users WHERE joined_at IS NOT NULL OR joined_groups = 1 "
+            "ORDER BY joined_at DESC LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        return [(row["user_id"], self._record(row)) for row in rows]
+
+    def migrate_from_json(self, path):
+        if not os.path.exists(path):
+            return 0
+        db = self.connect()
+        if db.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone():
+            return 0
+        with open(path, "r", encoding="utf-8") as f:
+            users = json.load(f)
+        now = datetime.utcnow().isoformat()
+        with self.transaction() as db:
+            # Re-checked under the write lock: several workers may start at once
+            if db.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone():
+                return 0
+            for uid, info in users.items():
+                balance = float(info.get("balance", 0) or 0)
+                db.execute(
+                    "INSERT OR REPLACE INTO users "
+                    "(user_id, balance, joined_groups, first_name, username, joined_at, last_bonus) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        str(uid),
+                        balance,
+                        1 if info.get("joined_groups") else 0,
+                        info.get("first_name"),
+                        info.get("username"),
+                        info.get("joined_at"),
+                        info.get("last_bonus"),
+                    ),
+                )
+                if balance:
+                    db.execute(
+                        "INSERT INTO ledger (user_id, kind, amount, created_at) VALUES (?, ?, ?, ?)",
+                        (str(uid), OPENING_BALANCE, balance, now),
+                    )
+            db.execute("INSERT INTO meta (key, value) VALUES ('migrated_from_json', ?)", (path,))
+        logger.info(f"Migrated {len(users)} users from {path} into {self.path}")
+        return len(users)
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+STORE_BACKENDS = {
+    "sqlite": SQLiteUserStore,
+}
+
+
+def open_store(url):
+    """Open a user store from a '<backend>:<path>' url, e.g. 'sqlite:users.db'."""
+    backend, _, path = url.partition(":")
+    if backend not in STORE_BACKENDS:
+        raise ValueError(f"Unknown user store backend: {backend}")
+    return STORE_BACKENDS[backend](path)
@@ -0,0 +1,83 @@
+# viewtokens.py — Single-use view tokens tying /watched to a rendered ad page
+import asyncio
+import logging
+import secrets
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS view_tokens (
+    token      TEXT PRIMARY KEY,
+    user_id    TEXT NOT NULL,
+    ad_id      INTEGER NOT NULL,
+    issued_at  REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS view_tokens_expires ON view_tokens (expires_at);
+"""
+
+
+class ViewTokens:
+    """Server-issued tokens: minted when an ad page renders, redeemed once by /watched.
+
+    Tokens live in the user store's database so every worker process sees
+    the same set. Redeeming first does a primary-key read, so unknown,
+    spent, expired or too-early tokens are turned away without a write;
+    only a valid token is deleted, and the delete's row count decides the
+    winner if the same token is posted twice at once.
+    """
+
+    def __init__(self, store, ttl=3600.0, min_watch=10.0, purge_every=300.0):
+        self.store = store
+        self.ttl = ttl
+        self.min_watch = min_watch
+        self.purge_every = purge_every
+        self._purged = time.time()
+        self.store.connect().executescript(SCHEMA)
+
+    def _mint(self, user_id, ad_id):
+        token = secrets.token_urlsafe(16)
+        now = time.time()
+        db = self.store.connect()
+        db.execute(
+            "INSERT INTO view_tokens (token, user_id, ad_id, issued_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (token, str(user_id), ad_id, now, now + self.ttl),
+        )
+        if now - self._purged >= self.purge_every:
+            self._purged = now
+            purged = db.execute("DELETE FROM view_tokens WHERE expires_at < ?", (now,)).rowcount
+            if purged:
+                logger.info(f"Purged {purged} expired view tokens")
+        return token
+
+    async def mint(self, user_id, ad_id):
+        """Issue a token for user_id watching ad_id."""
+        return await asyncio.to_thread(self._mint, user_id, ad_id)
+
+    def _consume(self, token):
+        return self.store.connect().execute("DELETE FROM view_tokens WHERE token = ?", (token,)).rowcount == 1
+
+    def _lookup(self, token):
+        return self.store.connect().execute(
+            "SELECT user_id, ad_id, issued_at, expires_at FROM view_tokens WHERE token = ?", (token,)
+        ).fetchone()
+
+    async def redeem(self, token, user_id):
+        """Spend a token. Returns (ad_id, None) on success or (None, reason)."""
+        if not token:
+            return None, "missing token"
+        row = await asyncio.to_thread(self._lookup, token)
+        now = time.time()
+        if row is None:
+            return None, "unknown or already used token"
+        if row["expires_at"] < now:
+            return None, "expired token"
+        if row["user_id"] != str(user_id):
+            return None, "token issued to another user"
+        if now - row["issued_at"] < self.min_watch:
+            # Left in place: the real end-of-video post can still redeem it
+            return None, "ad not watched long enough"
+        if not await asyncio.to_thread(self._consume, token):
+            return None, "unknown or already used token"
+        return row["ad_id"], None